@@ -4,10 +4,12 @@
 import os
 import base64
 import time
-import gc
+import logging
 import numpy as np
 # ... (imports)
-from config import UPLOAD_FOLDER, PASSING_THRESHOLD_DISTANCE, PASSING_THRESHOLD_PERCENTAGE
+from config import UPLOAD_FOLDER, PASSING_THRESHOLD_PERCENTAGE, LOG_LEVEL
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 import contract_service
 import ai_annotation_service
 import pdf_highlight_service
@@ -78,9 +80,8 @@ def upload_ic():
         face_service.store_temp_embedding(embedding)
 
         # Return embedding to frontend for later storage in users table
-        embedding_list = list(embedding) if embedding else None
-        del embedding
-        gc.collect()
+        # (base64-packed float32, decoded by face_service.decode_embedding)
+        embedding_list = face_service.encode_embedding(embedding) if embedding is not None else None
 
         print("📦 IC processed - awaiting face verification")
 
@@ -98,7 +99,6 @@ def upload_ic():
         print(f"Error uploading IC: {e}")
         import traceback
         traceback.print_exc()
-        gc.collect()
         response = jsonify({"status": "error", "message": str(e)})
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 500
@@ -199,8 +199,6 @@ def process_frame():
 
         np_arr = np.frombuffer(decoded_image, np.uint8)
         frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        del decoded_image, np_arr
-        gc.collect()
 
         if frame is None:
             response = jsonify(
@@ -211,12 +209,7 @@ def process_frame():
         # Generate embedding from frame using face_service
         try:
             camera_embedding = face_service.process_frame_for_embedding(frame)
-            del frame
-            gc.collect()
         except Exception as embed_error:
-            if 'frame' in locals():
-                del frame
-            gc.collect()
             response = jsonify(
                 {"status": "error", "message": f"Failed to process face: {embed_error}"})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -226,8 +219,6 @@ def process_frame():
         ic_embedding = face_service.get_temp_embedding()
 
         if ic_embedding is None:
-            del camera_embedding
-            gc.collect()
             response = jsonify(
                 {"status": "error", "message": "No IC record found. Please upload IC first."})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -237,9 +228,6 @@ def process_frame():
         is_match, score, distance = face_service.compare_embeddings(
             ic_embedding, camera_embedding)
 
-        del camera_embedding
-        gc.collect()
-
         if is_match:
             print(f"✅ Face verified! Score: {score}%")
             response = jsonify({
@@ -265,7 +253,6 @@ def process_frame():
         print(f"Error: {e}")
         import traceback
         traceback.print_exc()
-        gc.collect()
         response = jsonify({"status": "error", "message": str(e)})
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 500
@@ -323,8 +310,6 @@ def verify_login():
 
         np_arr = np.frombuffer(decoded_image, np.uint8)
         frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        del decoded_image, np_arr
-        gc.collect()
 
         if frame is None:
             response = jsonify(
@@ -335,12 +320,7 @@ def verify_login():
         # Generate embedding from camera frame
         try:
             camera_embedding = face_service.process_frame_for_embedding(frame)
-            del frame
-            gc.collect()
         except Exception as embed_error:
-            if 'frame' in locals():
-                del frame
-            gc.collect()
             response = jsonify(
                 {"status": "error", "message": f"Failed to process face: {embed_error}"})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -350,9 +330,6 @@ def verify_login():
         is_match, score, distance = face_service.compare_embeddings(
             stored_embedding, camera_embedding)
 
-        del camera_embedding
-        gc.collect()
-
         if is_match:
             print(f"✅ Login verified! Score: {score}%")
             response = jsonify({
@@ -377,7 +354,6 @@ def verify_login():
         print(f"Error in verify_login: {e}")
         import traceback
         traceback.print_exc()
-        gc.collect()
         response = jsonify({"status": "error", "message": str(e)})
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 500
@@ -429,8 +405,6 @@ def identify_face():
 
         np_arr = np.frombuffer(decoded_image, np.uint8)
         frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        del decoded_image, np_arr
-        gc.collect()
 
         if frame is None:
             response = jsonify(
@@ -441,12 +415,7 @@ def identify_face():
         # Generate embedding from camera frame
         try:
             camera_embedding = face_service.process_frame_for_embedding(frame)
-            del frame
-            gc.collect()
         except Exception as embed_error:
-            if 'frame' in locals():
-                del frame
-            gc.collect()
             response = jsonify(
                 {"success": False, "message": f"No face detected: {embed_error}"})
             response.headers.add('Access-Control-Allow-Origin', '*')
@@ -473,29 +442,9 @@ def identify_face():
             response.headers.add('Access-Control-Allow-Origin', '*')
             return response, 500
 
-        # Compare against all user embeddings and find best match
-        best_match = None
-        best_score = 0
-        best_distance = float('inf')
-
-        for user in users:
-            stored_embedding = user.get('face_embedding')
-            if not stored_embedding:
-                continue
-
-            is_match, score, distance = face_service.compare_embeddings(
-                stored_embedding, camera_embedding
-            )
-
-            # Track best match (even if below threshold, for debugging)
-            if distance < best_distance:
-                best_distance = distance
-                best_score = score
-                if is_match:
-                    best_match = user
-
-        del camera_embedding
-        gc.collect()
+        # Compare against all user embeddings at once and find best match
+        best_match, best_score, best_distance = face_service.find_best_match(
+            camera_embedding, users)
 
         if best_match:
             print(
@@ -527,7 +476,6 @@ def identify_face():
         print(f"Error in identify_face: {e}")
         import traceback
         traceback.print_exc()
-        gc.collect()
         response = jsonify({"success": False, "message": str(e)})
         response.headers.add('Access-Control-Allow-Origin', '*')
         return response, 500
@@ -645,9 +593,8 @@ def preview_contract():
         with open(pdf_path, 'rb') as f:
             pdf_data = f.read()
 
-        # Cleanup temp files
-        doc_path = filled_path.replace('_filled.docx', '.docx')
-        contract_service.cleanup_temp_files([doc_path, filled_path, pdf_path])
+        # Cleanup temp files (preview session folder holds both)
+        contract_service.cleanup_session_dir(os.path.dirname(filled_path))
 
         # Return PDF as blob
         response = make_response(pdf_data)
@@ -718,6 +665,8 @@ def prepare_contract():
 def get_prepared_contract(prepare_id):
     """
     Retrieve a prepared contract PDF by its prepare_id.
+    Waits a few seconds for the background PDF conversion; if it's still
+    running, returns 202 with Retry-After so the client polls again.
     Returns the PDF file as blob.
     """
     try:
@@ -731,6 +680,14 @@ def get_prepared_contract(prepare_id):
 
         pdf_path = contract_service.get_prepared_contract(prepare_id)
 
+        if not pdf_path and contract_service.is_prepared_contract_pending(prepare_id):
+            response = jsonify(
+                {"status": "pending", "message": "Contract PDF is still being generated, please retry"})
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            response.headers.add('Access-Control-Expose-Headers', 'Retry-After')
+            response.headers['Retry-After'] = '3'
+            return response, 202
+
         if not pdf_path:
             response = jsonify(
                 {"status": "error", "message": "Prepared contract not found"})
@@ -932,6 +889,8 @@ def clear_template_cache():
     """Admin endpoint to clear template cache (forces re-download on next use)"""
     try:
         contract_service.clear_template_cache()
+        # Highlighted previews were rendered from the old templates
+        pdf_highlight_service.clear_highlight_cache()
         response = jsonify({
             "status": "success",
             "message": "Template cache cleared successfully"
@@ -1295,13 +1254,21 @@ def get_highlighted_pdf():
         print(f"📄 Generating highlighted PDF for: {template_name}")
         print(f"   Received {len(annotations)} annotations from frontend")
 
+        # Keyed on the request itself, so a cache hit skips the AI call too
+        cache_key = pdf_highlight_service.highlight_cache_key(template_name, placeholders, annotations)
+        cached = pdf_highlight_service.get_cached_highlight(cache_key)
+        use_cache = True
+
         # If no annotations provided, generate them via AI
-        if not annotations:
+        if not cached and not annotations:
+            # Only cache AI results - a failed call shouldn't pin an unhighlighted PDF
+            use_cache = False
             text_result = contract_service.extract_contract_text(template_name, placeholders)
             if text_result.get('success') and text_result.get('text'):
                 ai_result = ai_annotation_service.extract_contract_annotations(text_result['text'])
                 if ai_result.get('success'):
                     annotations = ai_result.get('annotations', [])
+                    use_cache = True
                     print(f"✅ Generated {len(annotations)} AI annotations")
         
         # Debug: Show first annotation structure
@@ -1310,9 +1277,13 @@ def get_highlighted_pdf():
             print(f"   First highlighted_text: '{annotations[0].get('highlighted_text', '')[:50]}...'")
 
         # Generate highlighted PDF
-        result = pdf_highlight_service.create_highlighted_pdf_preview(
-            template_name, placeholders, annotations
-        )
+        if cached:
+            result = {"success": True, "cached": True, **cached}
+        else:
+            result = pdf_highlight_service.create_highlighted_pdf_preview(
+                template_name, placeholders, annotations,
+                cache_key=cache_key, use_cache=use_cache
+            )
 
         if not result.get('success'):
             response = jsonify({"success": False, "error": result.get('error', 'Failed to create PDF')})
@@ -1346,7 +1317,8 @@ def get_highlighted_pdf():
         try:
             if result.get('original_path') and os.path.exists(result.get('original_path')):
                 os.remove(result.get('original_path'))
-            if pdf_path and os.path.exists(pdf_path):
+            # Cached PDFs stay on disk for the next identical request
+            if pdf_path and not result.get('cached') and os.path.exists(pdf_path):
                 os.remove(pdf_path)
         except:
             pass
@@ -8,12 +8,19 @@ load_dotenv()
 # --- DATABASE (Optional - using Supabase from frontend) ---
 DB_URI = os.getenv("DB_URI", None)  # Optional, not required anymore
 
+# --- LOGGING ---
+# WARNING in production; set LOG_LEVEL=DEBUG to see per-request face/OCR details
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").upper()
+
 # --- FILE STORAGE ---
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # --- FACE RECOGNITION ---
 MODEL_NAME = "Facenet512"
-PASSING_THRESHOLD_DISTANCE = 20.0
-PASSING_THRESHOLD_PERCENTAGE = 45.0
+# Score = (cosine similarity + 1) * 50; 85% == cosine distance 0.30 (DeepFace Facenet512 default)
+PASSING_THRESHOLD_PERCENTAGE = 85.0
 MAX_IMAGE_SIZE = 800
+# Store new face embeddings as int8 (512 B instead of 2 KB). Existing float32
+# rows keep working, so this can be switched on before re-embedding users.
+EMBEDDING_INT8 = os.getenv("EMBEDDING_INT8", "false").lower() == "true"
@@ -7,8 +7,14 @@ import json
 import tempfile
 import io
 import base64
+import shutil
 import requests
 import time
+import copy
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from docx import Document
 from docx.shared import Inches
 from docx.enum.text import WD_COLOR_INDEX
@@ -30,10 +36,14 @@ TEMPLATE_BUCKET = "contract_templates"   # Bucket for .docx templates
 PDF_BUCKET = "contract-pdf"              # Bucket for generated PDFs
 GENERATED_FOLDER = "generated"
 
+# Shared keep-alive HTTP session for storage downloads/uploads
+HTTP = requests.Session()
+
 # ============================================
 # TEMPLATE CACHE - Store downloaded templates in memory
 # ============================================
 TEMPLATE_CACHE = {}  # { "storage_path": (file_bytes, timestamp) }
+_PARSED_TEMPLATE_CACHE = {}  # { "storage_path": Document } - parsed once, deep-copied per fill
 CACHE_EXPIRY_SECONDS = 3600  # 1 hour cache expiry
 
 
@@ -51,21 +61,86 @@ def get_cached_template(storage_path: str):
         else:
             print(f"⏰ Cache EXPIRED for '{storage_path}' (age: {age:.1f}s)")
             del TEMPLATE_CACHE[storage_path]
+            _PARSED_TEMPLATE_CACHE.pop(storage_path, None)
     return None, False
 
 
 def set_cached_template(storage_path: str, file_bytes: bytes):
     """Store template bytes in cache with current timestamp."""
     TEMPLATE_CACHE[storage_path] = (file_bytes, time.time())
+    _PARSED_TEMPLATE_CACHE.pop(storage_path, None)
     print(f"💾 Cached template: '{storage_path}' ({len(file_bytes)} bytes)")
 
 
 def clear_template_cache():
     """Clear all cached templates (useful for admin/debug)."""
     TEMPLATE_CACHE.clear()
+    _PARSED_TEMPLATE_CACHE.clear()
     print("🗑️ Template cache cleared")
 
 
+def get_parsed_template(storage_path: str, file_bytes: bytes):
+    """
+    Return a private copy of the parsed template Document.
+    The .docx is unzipped and parsed once per cache lifetime; every fill
+    gets a deep copy so edits never leak back into the cached tree.
+    """
+    parsed = _PARSED_TEMPLATE_CACHE.get(storage_path)
+    if parsed is None:
+        parsed = Document(io.BytesIO(file_bytes))
+        _PARSED_TEMPLATE_CACHE[storage_path] = parsed
+    return copy.deepcopy(parsed)
+
+
+# ============================================
+# CASE-INSENSITIVE PLACEHOLDERS
+# ============================================
+class CIDict(dict):
+    """
+    dict that stores string keys lowercased, so 'CREATOR_NAME' and
+    'creator_name' are one entry instead of two copies of the same value.
+    """
+
+    def __init__(self, data=(), **kwargs):
+        super().__init__()
+        self.update(data, **kwargs)
+
+    @staticmethod
+    def _key(key):
+        return key.lower() if isinstance(key, str) else key
+
+    def __setitem__(self, key, value):
+        super().__setitem__(self._key(key), value)
+
+    def __getitem__(self, key):
+        return super().__getitem__(self._key(key))
+
+    def __delitem__(self, key):
+        super().__delitem__(self._key(key))
+
+    def __contains__(self, key):
+        return super().__contains__(self._key(key))
+
+    def get(self, key, default=None):
+        return super().get(self._key(key), default)
+
+    def pop(self, key, *default):
+        return super().pop(self._key(key), *default)
+
+    def setdefault(self, key, default=None):
+        return super().setdefault(self._key(key), default)
+
+    def update(self, data=(), **kwargs):
+        for key, value in dict(data, **kwargs).items():
+            self[key] = value
+
+
+@functools.lru_cache(maxsize=512)
+def _placeholder_pattern(key: str):
+    """Compiled case-insensitive matcher for {{key}}"""
+    return re.compile(re.escape(f"{{{{{key}}}}}"), re.IGNORECASE)
+
+
 # ============================================
 
 # Template ID to file path mapping (loaded from config.json or hardcoded fallback)
@@ -88,22 +163,28 @@ except Exception as e:
     print(f"Warning: Failed to load templates_config.json: {e}")
     TEMPLATE_CONFIG = {"categories": []}
 
+# Flat template ID -> mapping index, built once so lookups are O(1)
+_TEMPLATE_INDEX = {
+    template['id']: template.get('mapping', {})
+    for category in TEMPLATE_CONFIG.get('categories', [])
+    for template in category.get('templates', [])
+}
+
 
 def get_template_mapping(template_id: str) -> dict:
     """Find mapping for a given template ID"""
-    for category in TEMPLATE_CONFIG.get('categories', []):
-        for template in category.get('templates', []):
-            if template['id'] == template_id:
-                return template.get('mapping', {})
-    return {}
+    return _TEMPLATE_INDEX.get(template_id, {})
 
 
 def map_placeholders(placeholders: dict, mapping: dict) -> dict:
     """
     Map frontend keys to Docx placeholders based on config.
     If a key is not in mapping, it is passed through as-is (fallback).
+    Keys are matched case-insensitively; returns a CIDict.
     """
-    mapped_data = {}
+    placeholders = CIDict(placeholders)
+    mapping = CIDict(mapping)
+    mapped_data = CIDict()
 
     # 1. Apply mapping
     for frontend_key, docx_key in mapping.items():
@@ -119,16 +200,42 @@ def map_placeholders(placeholders: dict, mapping: dict) -> dict:
 
 
 # Local temp folder for working files
+# Each contract gets its own subfolder (TEMP_FOLDER/<id>/) removed in one go
 TEMP_FOLDER = "temp_contracts"
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 
+# Contract/prepare ids from requests become folder and file names:
+# letters, digits, "_" and "-" only, so they can't point outside their folder
+SESSION_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+
 # Prepared contracts folder (stores pre-generated PDFs awaiting preview/signing)
 PREPARED_FOLDER = "prepared_contracts"
 os.makedirs(PREPARED_FOLDER, exist_ok=True)
 
-# Signatures folder (stores temporary signature images)
-SIGNATURES_FOLDER = "temp_signatures"
-os.makedirs(SIGNATURES_FOLDER, exist_ok=True)
+# ============================================
+# BACKGROUND PDF CONVERSION - prepare returns before the PDF is ready
+# ============================================
+# Background prepares run one at a time on their own worker. Word automation
+# (docx2pdf) cannot be driven concurrently, so every conversion also takes
+# the Word slot (word_session); interactive conversions go ahead of
+# queued background ones.
+PDF_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+PREPARED_FUTURES = {}  # { "prepare_id": Future } - queued/running in this process only
+
+# Conversion state lives on disk so every gunicorn worker sees it:
+# PREPARED_FOLDER/<id>.pending exists from prepare until the PDF is in place
+PENDING_SUFFIX = ".pending"
+# Waits stay well below gunicorn's 120s --timeout
+PREPARED_PDF_WAIT_SECONDS = 5        # /get_prepared_contract, then 202 "pending"
+PREPARED_PDF_MAX_WAIT_SECONDS = 90   # Server-side callers that need the PDF now
+PREPARED_EXPIRY_SECONDS = 3600  # Unclaimed prepared contracts are dropped after 1 hour
+
+_word_condition = threading.Condition()
+_word_busy = False
+_interactive_waiting = 0
+
+# Temp-file cleanup runs here, overlapping the DB round trip that follows an upload
+CLEANUP_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cleanup")
 
 
 def get_supabase_client() -> Client:
@@ -139,6 +246,15 @@ def get_supabase_client() -> Client:
     return create_client(SUPABASE_URL, SUPABASE_KEY)
 
 
+@functools.lru_cache(maxsize=4096)
+def _public_url(bucket: str, storage_path: str) -> str:
+    """
+    Public URL for a storage object (memoized).
+    Deterministic per (bucket, path), and our paths embed an immutable contract_id.
+    """
+    return get_supabase_client().storage.from_(bucket).get_public_url(storage_path)
+
+
 def get_template_path(template_id: str) -> str:
     """
     Get the storage path for a template ID.
@@ -156,28 +272,28 @@ def get_template_path(template_id: str) -> str:
     return f"{template_id}.docx"
 
 
-def download_template(template_name: str) -> str:
+def download_template(template_name: str, session_dir: str = TEMP_FOLDER) -> tuple:
     """
     Download .docx template from Supabase Storage (with caching).
     Accepts template ID (e.g., 'ITEM_BORROW') or full path.
-    Returns local file path.
+    Returns (Document, local_path): a fresh copy of the parsed template and
+    the local path (inside session_dir) the filled document should be
+    derived from. Nothing is written to disk - fill_template() works on the
+    Document directly.
 
     Caching: Templates are cached in memory for 1 hour to avoid
     repeated downloads of the same template file.
     """
     # Resolve template ID to storage path
     storage_path = get_template_path(template_name)
+    local_path = os.path.join(session_dir, os.path.basename(storage_path))
 
     # Check cache first
     cached_bytes, cache_hit = get_cached_template(storage_path)
 
     if cache_hit:
-        # Use cached template - save to local file and return
-        filename = os.path.basename(storage_path)
-        local_path = os.path.join(TEMP_FOLDER, filename)
-        with open(local_path, 'wb') as f:
-            f.write(cached_bytes)
-        return local_path
+        # Use cached template straight from memory
+        return get_parsed_template(storage_path, cached_bytes), local_path
 
     # Cache miss - download from Supabase
     supabase = get_supabase_client()
@@ -193,7 +309,7 @@ def download_template(template_name: str) -> str:
             url = signed_url_response['signedURL']
             print(f"Using signed URL")
 
-            response = requests.get(url)
+            response = HTTP.get(url)
             if response.status_code == 200:
                 file_bytes = response.content
     except Exception as e:
@@ -215,14 +331,7 @@ def download_template(template_name: str) -> str:
     # Cache the downloaded template
     set_cached_template(storage_path, file_bytes)
 
-    # Save to local temp file
-    filename = os.path.basename(storage_path)
-    local_path = os.path.join(TEMP_FOLDER, filename)
-    with open(local_path, 'wb') as f:
-        f.write(file_bytes)
-
-    print(f"Template saved to: {local_path}")
-    return local_path
+    return get_parsed_template(storage_path, file_bytes), local_path
 
 
 def fetch_image(image_source):
@@ -252,44 +361,56 @@ def fetch_image(image_source):
         return None
 
 
-def fill_template(doc_path: str, placeholders: dict) -> str:
+def fill_template(doc_source, placeholders: dict) -> str:
     """
     Replace {{PLACEHOLDER}} with actual values in the .docx document.
+    doc_source is either a local .docx path or a (Document or stream,
+    local_path) tuple such as the one returned by download_template().
     Handles text replacement and image insertion for signatures.
     Returns path to the filled document.
     """
+    placeholders = CIDict(placeholders)
     print(f"Filling template with {len(placeholders)} placeholders")
 
-    doc = Document(doc_path)
+    if isinstance(doc_source, tuple):
+        template, doc_path = doc_source
+        doc = Document(template) if hasattr(template, 'read') else template
+    else:
+        doc_path = doc_source
+        doc = Document(doc_path)
 
-    # Identify signature keys that should be treated as images (both upper and lowercase)
-    signature_keys = ['CREATOR_SIGNATURE', 'ACCEPTEE_SIGNATURE', 'ACCEPTOR_SIGNATURE', 'SIGNATURE',
-                      'creator_signature', 'acceptee_signature', 'acceptor_signature', 'signature']
+    # Identify signature keys that should be treated as images
+    # (placeholder keys are lowercase; the template may use either case)
+    signature_keys = {'creator_signature', 'acceptee_signature', 'acceptor_signature', 'signature'}
 
     # Keys that should be formatted with bold and yellow highlight (like creator name fields)
-    highlighted_keys = [
+    highlighted_keys = {
         # Body acceptee fields
-        'ACCEPTEE_NAME', 'acceptee_name', 'ACCEPTOR_NAME', 'acceptor_name',
-        'ACCEPTEE_IC', 'acceptee_ic', 'ACCEPTOR_IC', 'acceptor_ic',
+        'acceptee_name', 'acceptor_name',
+        'acceptee_ic', 'acceptor_ic',
         'acceptee_id_number', 'acceptor_id_number',
         # Signature section fields
-        'creator_signature_name', 'CREATOR_SIGNATURE_NAME',
-        'creator_signature_id', 'CREATOR_SIGNATURE_ID',
-        'creator_signature_date', 'CREATOR_SIGNATURE_DATE',
-        'acceptee_signature_name', 'ACCEPTEE_SIGNATURE_NAME', 'acceptor_signature_name', 'ACCEPTOR_SIGNATURE_NAME',
-        'acceptee_signature_id', 'ACCEPTEE_SIGNATURE_ID', 'acceptor_signature_id', 'ACCEPTOR_SIGNATURE_ID',
-        'acceptee_signature_date', 'ACCEPTEE_SIGNATURE_DATE', 'acceptor_signature_date', 'ACCEPTOR_SIGNATURE_DATE',
-        'ACCEPTOR_SIGNING_DATE', 'acceptor_signing_date',
-        'ACCEPTEE_SIGNING_DATE', 'acceptee_signing_date'
-    ]
+        'creator_signature_name', 'creator_signature_id', 'creator_signature_date',
+        'acceptee_signature_name', 'acceptor_signature_name',
+        'acceptee_signature_id', 'acceptor_signature_id',
+        'acceptee_signature_date', 'acceptor_signature_date',
+        'acceptor_signing_date', 'acceptee_signing_date'
+    }
 
     def process_paragraph(paragraph):
         # We invoke this for every placeholder.
+        text = paragraph.text
+        text_lower = text.lower()
         for key, value in placeholders.items():
-            placeholder = f"{{{{{key}}}}}"  # {{KEY}}
-
             # Quick check if placeholder exists in the full text at all
-            if placeholder in paragraph.text:
+            if f"{{{{{key}}}}}" not in text_lower:
+                continue
+
+            # Collect the spellings actually used in the document ({{KEY}}, {{key}})
+            spellings = dict.fromkeys(
+                m.group(0) for m in _placeholder_pattern(key).finditer(text))
+
+            for placeholder in spellings:
 
                 # Special handling for signatures (images)
                 if key in signature_keys and value:
@@ -371,6 +492,10 @@ def fill_template(doc_path: str, placeholders: dict) -> str:
                         paragraph.text = paragraph.text.replace(
                             placeholder, str(value))
 
+            # Paragraph changed - refresh cached text for the remaining keys
+            text = paragraph.text
+            text_lower = text.lower()
+
     # Replace in paragraphs
     for paragraph in doc.paragraphs:
         process_paragraph(paragraph)
@@ -390,11 +515,50 @@ def fill_template(doc_path: str, placeholders: dict) -> str:
     return filled_path
 
 
+@contextmanager
+def word_session(interactive: bool = True):
+    """
+    Hold the single Word slot for one conversion. Background prepares only
+    start when no interactive (request-thread) conversion is waiting.
+    """
+    global _word_busy, _interactive_waiting
+    with _word_condition:
+        if interactive:
+            _interactive_waiting += 1
+        try:
+            while _word_busy or (not interactive and _interactive_waiting):
+                _word_condition.wait()
+            _word_busy = True
+        finally:
+            if interactive:
+                _interactive_waiting -= 1
+    try:
+        yield
+    finally:
+        with _word_condition:
+            _word_busy = False
+            _word_condition.notify_all()
+
+
 def convert_to_pdf(docx_path: str) -> str:
     """
     Convert .docx to PDF using Microsoft Word.
-    Returns path to the PDF file.
+    Runs on the calling thread once the Word slot is free (ahead of queued
+    background prepares). Returns path to the PDF file.
     """
+    with word_session(interactive=True):
+        return _convert_docx(docx_path)
+
+
+def _convert_docx(docx_path: str) -> str:
+    """Convert .docx to PDF with Word. Callers hold word_session()."""
+    # Word automation needs COM initialised on every thread that drives it
+    try:
+        import pythoncom
+        pythoncom.CoInitialize()
+    except ImportError:
+        pythoncom = None
+
     print(f"Converting to PDF...")
 
     pdf_path = docx_path.replace('.docx', '.pdf')
@@ -417,6 +581,29 @@ def convert_to_pdf(docx_path: str) -> str:
             return pdf_path
         print(f"PDF conversion failed: {e}")
         raise
+    finally:
+        if pythoncom:
+            pythoncom.CoUninitialize()
+
+
+def stream_upload_pdf(supabase, pdf_path: str, storage_path: str):
+    """
+    Upload a PDF to the PDF bucket through a signed upload URL.
+    The file object is handed to requests, which sends it in chunks,
+    so the PDF is never read into memory as a whole.
+    Raises an exception (with the storage error text) on failure.
+    """
+    signed = supabase.storage.from_(
+        PDF_BUCKET).create_signed_upload_url(storage_path)
+    url = signed.get('signed_url') or signed.get('signedUrl')
+
+    with open(pdf_path, 'rb') as f:
+        response = HTTP.put(
+            url, data=f, headers={"Content-Type": "application/pdf"})
+
+    if response.status_code not in (200, 201):
+        raise Exception(
+            f"Upload failed ({response.status_code}): {response.text}")
 
 
 def upload_pdf(pdf_path: str, contract_id: str) -> str:
@@ -431,20 +618,25 @@ def upload_pdf(pdf_path: str, contract_id: str) -> str:
 
     print(f"Uploading PDF to bucket '{PDF_BUCKET}': {storage_path}")
 
-    # Read PDF file
-    with open(pdf_path, 'rb') as f:
-        pdf_data = f.read()
-
-    # Upload to Supabase PDF bucket
-    response = supabase.storage.from_(PDF_BUCKET).upload(
-        storage_path,
-        pdf_data,
-        file_options={"content-type": "application/pdf"}
-    )
+    # Stream PDF to Supabase PDF bucket
+    try:
+        stream_upload_pdf(supabase, pdf_path, storage_path)
+    except Exception as e:
+        # If file already exists, try to update it
+        if "already exists" in str(e).lower() or "duplicate" in str(e).lower():
+            print(f"File exists, updating: {storage_path}")
+            # Pass the open file - storage streams it instead of a bytes copy
+            with open(pdf_path, 'rb') as f:
+                response = supabase.storage.from_(PDF_BUCKET).update(
+                    storage_path,
+                    f,
+                    file_options={"content-type": "application/pdf"}
+                )
+        else:
+            raise e
 
     # Get public URL
-    public_url = supabase.storage.from_(
-        PDF_BUCKET).get_public_url(storage_path)
+    public_url = _public_url(PDF_BUCKET, storage_path)
 
     print(f"PDF uploaded: {public_url}")
     return public_url
@@ -453,20 +645,21 @@ def upload_pdf(pdf_path: str, contract_id: str) -> str:
 # Keys that should NOT be filled during initial contract creation
 # These are the SIGNATURE SECTION fields - filled only when the creator/acceptor signs
 # Note: Body placeholders like creator_name, acceptee_name ARE filled during creation
-SIGNING_FIELDS_TO_EXCLUDE = [
+# Keys are lowercase; matching is case-insensitive
+SIGNING_FIELDS_TO_EXCLUDE = {
     # Creator signature section fields (filled when creator signs)
-    'creator_signature', 'CREATOR_SIGNATURE',
-    'creator_signature_name', 'CREATOR_SIGNATURE_NAME',
-    'creator_signature_id', 'CREATOR_SIGNATURE_ID',
-    'creator_signature_date', 'CREATOR_SIGNATURE_DATE',
-    'signing_date', 'SIGNING_DATE', 'creator_signing_date', 'CREATOR_SIGNING_DATE',
+    'creator_signature',
+    'creator_signature_name',
+    'creator_signature_id',
+    'creator_signature_date',
+    'signing_date', 'creator_signing_date',
     # Acceptor/Acceptee signature section fields (filled when acceptee signs)
-    'acceptor_signature', 'ACCEPTOR_SIGNATURE', 'acceptee_signature', 'ACCEPTEE_SIGNATURE',
-    'acceptor_signature_name', 'ACCEPTOR_SIGNATURE_NAME', 'acceptee_signature_name', 'ACCEPTEE_SIGNATURE_NAME',
-    'acceptor_signature_id', 'ACCEPTOR_SIGNATURE_ID', 'acceptee_signature_id', 'ACCEPTEE_SIGNATURE_ID',
-    'acceptor_signature_date', 'ACCEPTOR_SIGNATURE_DATE', 'acceptee_signature_date', 'ACCEPTEE_SIGNATURE_DATE',
-    'acceptor_signing_date', 'ACCEPTOR_SIGNING_DATE', 'acceptee_signing_date', 'ACCEPTEE_SIGNING_DATE',
-]
+    'acceptor_signature', 'acceptee_signature',
+    'acceptor_signature_name', 'acceptee_signature_name',
+    'acceptor_signature_id', 'acceptee_signature_id',
+    'acceptor_signature_date', 'acceptee_signature_date',
+    'acceptor_signing_date', 'acceptee_signing_date',
+}
 
 
 def exclude_signing_fields(placeholders: dict) -> dict:
@@ -475,10 +668,10 @@ def exclude_signing_fields(placeholders: dict) -> dict:
     These fields (creator name, IC, signature, date, and acceptor equivalents)
     should remain as placeholders in the document until actual signing.
     """
-    return {
-        key: value for key, value in placeholders.items()
-        if key not in SIGNING_FIELDS_TO_EXCLUDE
-    }
+    return CIDict(
+        (key, value) for key, value in placeholders.items()
+        if key.lower() not in SIGNING_FIELDS_TO_EXCLUDE
+    )
 
 
 def generate_contract(template_name: str, placeholders: dict, contract_id: str) -> dict:
@@ -486,6 +679,13 @@ def generate_contract(template_name: str, placeholders: dict, contract_id: str)
     Full workflow: download template -> fill placeholders -> convert to PDF -> upload.
     Returns dict with success status and PDF URL.
     """
+    try:
+        session_dir = create_session_dir(contract_id)
+    except ValueError as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
     try:
         # Step 0: Map placeholders
         mapping = get_template_mapping(template_name)
@@ -503,10 +703,10 @@ def generate_contract(template_name: str, placeholders: dict, contract_id: str)
         print(f"Mapped placeholders for {template_name}")
 
         # Step 1: Download template
-        doc_path = download_template(template_name)
+        template_source = download_template(template_name, session_dir)
 
         # Step 2: Fill placeholders
-        filled_path = fill_template(doc_path, mapped_placeholders)
+        filled_path = fill_template(template_source, mapped_placeholders)
 
         # Step 3: Convert to PDF
         pdf_path = convert_to_pdf(filled_path)
@@ -514,9 +714,6 @@ def generate_contract(template_name: str, placeholders: dict, contract_id: str)
         # Step 4: Upload PDF
         pdf_url = upload_pdf(pdf_path, contract_id)
 
-        # Cleanup temp files
-        cleanup_temp_files([doc_path, filled_path, pdf_path])
-
         return {
             "success": True,
             "pdf_url": pdf_url,
@@ -532,6 +729,10 @@ def generate_contract(template_name: str, placeholders: dict, contract_id: str)
             "error": str(e)
         }
 
+    finally:
+        # Cleanup temp files
+        cleanup_session_dir(session_dir)
+
 
 def cleanup_temp_files(file_paths: list):
     """Remove temporary files"""
@@ -543,18 +744,101 @@ def cleanup_temp_files(file_paths: list):
             pass
 
 
+def is_valid_session_id(session_id) -> bool:
+    """True if session_id is safe to use as a folder/file name"""
+    return isinstance(session_id, str) and SESSION_ID_RE.fullmatch(session_id) is not None
+
+
+def create_session_dir(session_id: str) -> str:
+    """
+    Create a working folder for one contract under TEMP_FOLDER.
+    The filled .docx and its PDF are written here.
+    Raises ValueError for ids that aren't a plain name (see SESSION_ID_RE).
+    Returns the folder path.
+    """
+    if not is_valid_session_id(session_id):
+        raise ValueError(f"Invalid contract id: {session_id!r}")
+    session_dir = os.path.join(TEMP_FOLDER, session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    return session_dir
+
+
+def cleanup_session_dir(session_dir: str):
+    """Remove a contract working folder and everything in it"""
+    # Only ever delete folders strictly inside TEMP_FOLDER (never the folder
+    # itself, nothing reached through "..", absolute paths or symlinks)
+    root = os.path.realpath(TEMP_FOLDER)
+    target = os.path.realpath(session_dir)
+    if os.path.dirname(target) != root:
+        print(f"⚠️ Refusing to remove folder outside {TEMP_FOLDER}: {session_dir}")
+        return
+    shutil.rmtree(target, ignore_errors=True)
+
+
+def _prepared_paths(prepare_id: str) -> tuple:
+    """(prepared PDF path, pending marker path) for a prepare_id"""
+    base = os.path.join(PREPARED_FOLDER, prepare_id)
+    return f"{base}.pdf", f"{base}{PENDING_SUFFIX}"
+
+
+def _convert_prepared_contract(prepare_id: str, session_dir: str, filled_path: str) -> str:
+    """
+    Background task: convert a filled .docx to PDF and move it to the prepared folder.
+    Runs on PDF_EXECUTOR. Returns the prepared PDF path (None if the contract
+    was cleaned up meanwhile).
+
+    The pending marker is the claim on the output: cleanup removes it before
+    the PDF, this task removes it after the PDF is in place. Whichever side
+    finds it already gone knows the other ran, so no PDF is left behind.
+    """
+    prepared_pdf_path, pending_path = _prepared_paths(prepare_id)
+    try:
+        if not os.path.exists(pending_path):
+            print(f"Prepared contract cleaned up before conversion: {prepare_id}")
+            return None
+
+        with word_session(interactive=False):
+            pdf_path = _convert_docx(filled_path)
+        os.replace(pdf_path, prepared_pdf_path)
+
+        try:
+            os.remove(pending_path)
+        except FileNotFoundError:
+            # Cleaned up while converting - drop the output
+            _remove_prepared_files(prepare_id)
+            return None
+
+        print(f"Contract prepared: {prepared_pdf_path}")
+        return prepared_pdf_path
+    except Exception:
+        # Failed: no PDF will appear, so stop reporting it as pending
+        try:
+            os.remove(pending_path)
+        except FileNotFoundError:
+            pass
+        raise
+    finally:
+        # Cleanup temp files (the prepared PDF was moved out already)
+        cleanup_session_dir(session_dir)
+
+
 def prepare_contract(template_name: str, placeholders: dict) -> dict:
     """
-    Prepare contract by downloading template, filling placeholders, and converting to PDF.
-    Stores PDF in prepared_contracts folder for later retrieval.
+    Prepare contract by downloading template and filling placeholders.
+    PDF conversion is submitted to a background worker so the caller gets
+    the prepare_id without waiting for Word; get_prepared_contract() waits
+    briefly for the PDF.
     Returns dict with prepare_id to retrieve the PDF later.
     """
     import uuid
 
-    try:
-        # Generate unique ID for this prepared contract
-        prepare_id = str(uuid.uuid4())[:8]
+    evict_stale_prepared_contracts()
+
+    # Generate unique ID for this prepared contract
+    prepare_id = str(uuid.uuid4())[:8]
+    session_dir = create_session_dir(prepare_id)
 
+    try:
         print(f"Preparing contract: {template_name} (ID: {prepare_id})")
 
         # Step 0: Map placeholders
@@ -565,22 +849,20 @@ def prepare_contract(template_name: str, placeholders: dict) -> dict:
         mapped_placeholders = exclude_signing_fields(mapped_placeholders)
 
         # Step 1: Download template
-        doc_path = download_template(template_name)
+        template_source = download_template(template_name, session_dir)
 
         # Step 2: Fill placeholders
-        filled_path = fill_template(doc_path, mapped_placeholders)
+        filled_path = fill_template(template_source, mapped_placeholders)
 
-        # Step 3: Convert to PDF
-        pdf_path = convert_to_pdf(filled_path)
-
-        # Step 4: Move PDF to prepared folder with prepare_id
-        prepared_pdf_path = os.path.join(PREPARED_FOLDER, f"{prepare_id}.pdf")
-        os.rename(pdf_path, prepared_pdf_path)
+        # Step 3: Convert to PDF in the background (worker removes session_dir)
+        _, pending_path = _prepared_paths(prepare_id)
+        open(pending_path, 'w').close()
+        future = PDF_EXECUTOR.submit(
+            _convert_prepared_contract, prepare_id, session_dir, filled_path)
+        PREPARED_FUTURES[prepare_id] = future
+        future.add_done_callback(lambda _: PREPARED_FUTURES.pop(prepare_id, None))
 
-        # Cleanup temp files (but keep the prepared PDF)
-        cleanup_temp_files([doc_path, filled_path])
-
-        print(f"Contract prepared: {prepared_pdf_path}")
+        print(f"Contract queued for PDF conversion: {prepare_id}")
 
         return {
             "success": True,
@@ -592,57 +874,106 @@ def prepare_contract(template_name: str, placeholders: dict) -> dict:
         print(f"Contract preparation failed: {e}")
         import traceback
         traceback.print_exc()
+        cleanup_session_dir(session_dir)
         return {
             "success": False,
             "error": str(e)
         }
 
 
-def get_prepared_contract(prepare_id: str) -> str:
+def get_prepared_contract(prepare_id: str, wait_seconds: float = PREPARED_PDF_WAIT_SECONDS) -> str:
     """
     Get the path to a prepared contract PDF.
-    Returns the file path or None if not found.
+    Waits up to wait_seconds for a pending background conversion (in any
+    worker process - the state is on disk).
+    Returns the file path or None if not found (or still converting - check
+    is_prepared_contract_pending()).
     """
-    pdf_path = os.path.join(PREPARED_FOLDER, f"{prepare_id}.pdf")
+    if not is_valid_session_id(prepare_id):
+        return None
+    pdf_path, _ = _prepared_paths(prepare_id)
+
+    deadline = time.time() + wait_seconds
+    while is_prepared_contract_pending(prepare_id) and time.time() < deadline:
+        time.sleep(0.25)
+
+    if is_prepared_contract_pending(prepare_id):
+        print(f"⏰ PDF conversion still running for: {prepare_id}")
+        return None
     if os.path.exists(pdf_path):
         return pdf_path
     return None
 
 
-def cleanup_prepared_contract(prepare_id: str):
-    """Remove a prepared contract after it's been used"""
-    pdf_path = os.path.join(PREPARED_FOLDER, f"{prepare_id}.pdf")
-    if os.path.exists(pdf_path):
+def is_prepared_contract_pending(prepare_id: str) -> bool:
+    """True while the background PDF conversion for prepare_id hasn't finished"""
+    if not is_valid_session_id(prepare_id):
+        return False
+    _, pending_path = _prepared_paths(prepare_id)
+    try:
+        # A marker older than the expiry belongs to a worker that died mid-conversion
+        return time.time() - os.path.getmtime(pending_path) < PREPARED_EXPIRY_SECONDS
+    except OSError:
+        return False
+
+
+def _remove_prepared_files(prepare_id: str):
+    """Remove the pending marker (first) and the prepared PDF"""
+    for path in reversed(_prepared_paths(prepare_id)):
         try:
-            os.remove(pdf_path)
-            print(f"Cleaned up prepared contract: {prepare_id}")
+            os.remove(path)
+            print(f"Cleaned up prepared contract: {os.path.basename(path)}")
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"Failed to cleanup prepared contract: {e}")
 
 
-def save_signature_image(signature_base64: str, signature_id: str) -> str:
-    """
-    Save base64 signature image to temp folder.
-    Returns the local file path.
-    """
-    try:
-        # Remove data URL prefix if present
-        if ',' in signature_base64:
-            signature_base64 = signature_base64.split(',')[1]
-
-        # Decode base64
-        signature_data = base64.b64decode(signature_base64)
+def cleanup_prepared_contract(prepare_id: str):
+    """Remove a prepared contract after it's been used"""
+    if not is_valid_session_id(prepare_id):
+        return
+    future = PREPARED_FUTURES.pop(prepare_id, None)
+    if future is not None and future.cancel():
+        # Never started: its working folder is still there
+        cleanup_session_dir(os.path.join(TEMP_FOLDER, prepare_id))
+
+    # Marker first: a conversion still running (here or in another worker)
+    # then discards its own output
+    _remove_prepared_files(prepare_id)
+
+
+def evict_stale_prepared_contracts():
+    """Drop prepared contracts nobody claimed within PREPARED_EXPIRY_SECONDS"""
+    now = time.time()
+    for name in os.listdir(PREPARED_FOLDER):
+        prepare_id, ext = os.path.splitext(name)
+        if ext not in ('.pdf', PENDING_SUFFIX) or not is_valid_session_id(prepare_id):
+            continue
+        try:
+            if now - os.path.getmtime(os.path.join(PREPARED_FOLDER, name)) < PREPARED_EXPIRY_SECONDS:
+                continue
+        except OSError:
+            continue
+        print(f"⏰ Prepared contract expired: {prepare_id}")
+        cleanup_prepared_contract(prepare_id)
+        cleanup_session_dir(os.path.join(TEMP_FOLDER, prepare_id))
 
-        # Save to file
-        signature_path = os.path.join(SIGNATURES_FOLDER, f"{signature_id}.png")
-        with open(signature_path, 'wb') as f:
-            f.write(signature_data)
 
-        print(f"Signature saved: {signature_path}")
-        return signature_path
-    except Exception as e:
-        print(f"Failed to save signature: {e}")
+def signature_data_url(signature_base64: str) -> str:
+    """
+    Normalise a signature to a PNG data URL, the form fill_template() inserts
+    as an image. Accepts a data URL (returned as-is) or bare base64.
+    Returns None if no signature was given.
+    """
+    if not signature_base64:
         return None
+    if signature_base64.startswith('data:image'):
+        return signature_base64
+    # Remove any other "prefix," before the payload
+    if ',' in signature_base64:
+        signature_base64 = signature_base64.split(',', 1)[1]
+    return f"data:image/png;base64,{signature_base64}"
 
 
 def generate_signed_contract(
@@ -651,61 +982,53 @@ def generate_signed_contract(
     creator_signature_base64: str,
     creator_name: str,
     creator_ic: str,
-    contract_id: str
+    contract_id: str,
+    signing_timestamp: str = None
 ) -> str:
     """
     Generate a signed version of the contract with:
     - Creator signature image
     - Timestamp of signing
     - Creator name and IC
-    Returns path to the signed PDF.
+    signing_timestamp defaults to now (YYYY-MM-DD HH:MM:SS).
+    Returns path to the signed PDF, inside the TEMP_FOLDER/<contract_id>
+    session folder (the caller removes it with cleanup_session_dir).
     """
     from datetime import datetime
 
+    session_dir = create_session_dir(contract_id)
     try:
         print(f"Generating signed contract: {contract_id}")
 
-        # Save signature to temp file
-        signature_path = save_signature_image(
-            creator_signature_base64, f"sig_{contract_id}")
-
         # Get current timestamp with date and time (YYYY-MM-DD HH:MM:SS)
-        signing_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if not signing_timestamp:
+            signing_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         # Update placeholders with signature info
-        signed_placeholders = {**placeholders}
+        # (CIDict: one entry serves both {{KEY}} and {{key}} in the template)
+        signed_placeholders = CIDict(placeholders)
 
         # Add creator signature (will be inserted as image)
-        if signature_path and os.path.exists(signature_path):
-            with open(signature_path, 'rb') as f:
-                sig_data = f.read()
-            sig_base64 = f"data:image/png;base64,{base64.b64encode(sig_data).decode()}"
-            signed_placeholders['CREATOR_SIGNATURE'] = sig_base64
-            signed_placeholders['creator_signature'] = sig_base64
-
-        # Add signing details - support both uppercase and lowercase
-        signed_placeholders['SIGNING_DATE'] = signing_timestamp
+        sig_url = signature_data_url(creator_signature_base64)
+        if sig_url:
+            signed_placeholders['creator_signature'] = sig_url
+
+        # Add signing details
         signed_placeholders['signing_date'] = signing_timestamp
-        signed_placeholders['CREATOR_SIGNING_DATE'] = signing_timestamp
         signed_placeholders['creator_signing_date'] = signing_timestamp
 
         # Creator signature section fields (new placeholders from template)
         signed_placeholders['creator_signature_name'] = creator_name
-        signed_placeholders['CREATOR_SIGNATURE_NAME'] = creator_name
         signed_placeholders['creator_signature_id'] = creator_ic
-        signed_placeholders['CREATOR_SIGNATURE_ID'] = creator_ic
         signed_placeholders['creator_signature_date'] = signing_timestamp
-        signed_placeholders['CREATOR_SIGNATURE_DATE'] = signing_timestamp
 
         # Legacy creator name/IC fields (for backward compatibility)
-        signed_placeholders['CREATOR_NAME'] = creator_name
         signed_placeholders['creator_name'] = creator_name
-        signed_placeholders['CREATOR_IC'] = creator_ic
         signed_placeholders['creator_ic'] = creator_ic
         signed_placeholders['creator_id_number'] = creator_ic
 
         # Download template fresh
-        doc_path = download_template(template_name)
+        template_source = download_template(template_name, session_dir)
 
         # Apply mapping to ensure frontend keys match Word template placeholders
         mapping = get_template_mapping(template_name)
@@ -715,16 +1038,11 @@ def generate_signed_contract(
             f"DEBUG: Signed contract placeholders: {list(mapped_placeholders.keys())}")
 
         # Fill with updated placeholders including signature
-        filled_path = fill_template(doc_path, mapped_placeholders)
+        filled_path = fill_template(template_source, mapped_placeholders)
 
         # Convert to PDF
         pdf_path = convert_to_pdf(filled_path)
 
-        # Cleanup temp files
-        cleanup_temp_files([doc_path, filled_path])
-        if signature_path and os.path.exists(signature_path):
-            cleanup_temp_files([signature_path])
-
         print(f"Signed contract generated: {pdf_path}")
         return pdf_path
 
@@ -732,6 +1050,7 @@ def generate_signed_contract(
         print(f"Failed to generate signed contract: {e}")
         import traceback
         traceback.print_exc()
+        cleanup_session_dir(session_dir)
         return None
 
 
@@ -739,8 +1058,12 @@ def generate_signed_contract(
 def preview_contract(template_name: str, placeholders: dict) -> str:
     """
     Generate preview of contract (filled .docx).
-    Returns local path to filled document.
+    Returns local path to filled document, inside its own session folder
+    (remove it with cleanup_session_dir(os.path.dirname(path))).
     """
+    import uuid
+
+    session_dir = create_session_dir(f"preview_{str(uuid.uuid4())[:8]}")
     try:
         # Step 0: Map placeholders
         print(f"\nDEBUG: Previewing template: {template_name}")
@@ -755,13 +1078,14 @@ def preview_contract(template_name: str, placeholders: dict) -> str:
         print(
             f"DEBUG: Mapped Preview Placeholders (after excluding signing fields): {mapped_placeholders}")
 
-        doc_path = download_template(template_name)
-        filled_path = fill_template(doc_path, mapped_placeholders)
+        template_source = download_template(template_name, session_dir)
+        filled_path = fill_template(template_source, mapped_placeholders)
         return filled_path
     except Exception as e:
         print(f"Preview failed: {e}")
         import traceback
         traceback.print_exc()
+        cleanup_session_dir(session_dir)
         raise
 
 
@@ -801,8 +1125,7 @@ def extract_contract_text(template_name: str, placeholders: dict) -> dict:
         full_text = "\n".join(lines)
         
         # Cleanup temp file
-        doc_path = filled_path.replace('_filled.docx', '.docx')
-        cleanup_temp_files([doc_path, filled_path])
+        cleanup_session_dir(os.path.dirname(filled_path))
         
         print(f"✅ Extracted {len(full_text)} characters from contract")
         
@@ -836,32 +1159,25 @@ def upload_contract_pdf(pdf_path: str, user_id: str, contract_id: str) -> str:
 
     print(f"Uploading PDF to bucket '{PDF_BUCKET}': {storage_path}")
 
-    # Read PDF file
-    with open(pdf_path, 'rb') as f:
-        pdf_data = f.read()
-
-    # Upload to Supabase PDF bucket
+    # Stream PDF to Supabase PDF bucket
     try:
-        response = supabase.storage.from_(PDF_BUCKET).upload(
-            storage_path,
-            pdf_data,
-            file_options={"content-type": "application/pdf"}
-        )
+        stream_upload_pdf(supabase, pdf_path, storage_path)
     except Exception as e:
         # If file already exists, try to update it
         if "already exists" in str(e).lower() or "duplicate" in str(e).lower():
             print(f"File exists, updating: {storage_path}")
-            response = supabase.storage.from_(PDF_BUCKET).update(
-                storage_path,
-                pdf_data,
-                file_options={"content-type": "application/pdf"}
-            )
+            # Pass the open file - storage streams it instead of a bytes copy
+            with open(pdf_path, 'rb') as f:
+                response = supabase.storage.from_(PDF_BUCKET).update(
+                    storage_path,
+                    f,
+                    file_options={"content-type": "application/pdf"}
+                )
         else:
             raise e
 
     # Get public URL
-    public_url = supabase.storage.from_(
-        PDF_BUCKET).get_public_url(storage_path)
+    public_url = _public_url(PDF_BUCKET, storage_path)
 
     print(f"PDF uploaded: {public_url}")
     return public_url
@@ -886,6 +1202,28 @@ def create_contract_record(contract_data: dict) -> dict:
         raise Exception("Failed to create contract record")
 
 
+def create_contract_records(rows: list) -> list:
+    """
+    Create several contract records in one insert (batch generation).
+    Returns the created contract data.
+    """
+    if not rows:
+        return []
+
+    supabase = get_supabase_client()
+
+    print(f"Creating {len(rows)} contract records")
+
+    # Single round trip for the whole batch
+    result = supabase.table('contracts').insert(rows).execute()
+
+    if result.data:
+        print(f"Contract records created: {len(result.data)}")
+        return result.data
+    else:
+        raise Exception("Failed to create contract records")
+
+
 def finalize_contract(
     prepare_id: str,
     user_id: str,
@@ -906,16 +1244,20 @@ def finalize_contract(
     1. Generate signed PDF with creator signature, timestamp, and details
     2. Upload PDF to storage under user_id folder
     3. Create contract record in database
-    4. Cleanup prepared contract
+    4. Cleanup prepared contract (in the background, alongside step 3)
     Returns dict with contract data and PDF URL.
     """
     import uuid
     from datetime import datetime, timedelta
 
-    try:
-        # Generate contract ID
-        contract_id = f"CNT-{datetime.now().strftime('%Y%m%d%H%M%S')}-{str(uuid.uuid4())[:4].upper()}"
+    # One timestamp for the whole contract (ID, signature date, created_at, due_date)
+    now = datetime.now()
+    creator_signing_timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
 
+    # Generate contract ID
+    contract_id = f"CNT-{now.strftime('%Y%m%d%H%M%S')}-{str(uuid.uuid4())[:4].upper()}"
+
+    try:
         print(f"Finalizing contract: {contract_id}")
 
         # Step 1: Generate signed contract with signature embedded
@@ -935,7 +1277,8 @@ def finalize_contract(
                 creator_signature_base64=creator_signature,
                 creator_name=creator_name or 'Unknown',
                 creator_ic=creator_ic or 'Unknown',
-                contract_id=contract_id
+                contract_id=contract_id,
+                signing_timestamp=creator_signing_timestamp
             )
 
             if not pdf_path:
@@ -946,6 +1289,11 @@ def finalize_contract(
             pdf_path = get_prepared_contract(prepare_id)
 
         if not pdf_path:
+            if is_prepared_contract_pending(prepare_id):
+                return {
+                    "success": False,
+                    "error": "Contract PDF is still being generated, please retry"
+                }
             return {
                 "success": False,
                 "error": f"Contract PDF not found"
@@ -954,12 +1302,13 @@ def finalize_contract(
         # Step 2: Upload PDF to storage under user_id folder
         pdf_url = upload_contract_pdf(pdf_path, user_id, contract_id)
 
+        # Local files are no longer needed - clean up while the record is inserted
+        CLEANUP_EXECUTOR.submit(cleanup_prepared_contract, prepare_id)
+        CLEANUP_EXECUTOR.submit(cleanup_session_dir, os.path.join(TEMP_FOLDER, contract_id))
+
         # Step 3: Create contract record in database
         # IMPORTANT: Save creator signature and signature section fields to form_data
         # so they can be used when acceptor signs
-        from datetime import datetime as dt
-        creator_signing_timestamp = dt.now().strftime("%Y-%m-%d %H:%M:%S")
-
         form_data_with_signature = {**form_data}
         if creator_signature:
             form_data_with_signature['creator_signature'] = creator_signature
@@ -984,17 +1333,12 @@ def finalize_contract(
             "creator_face_verified": creator_face_verified,
             "acceptee_nfc_verified": False,
             "acceptee_face_verified": False,
-            "created_at": datetime.now().isoformat(),
-            "due_date": due_date or (datetime.now() + timedelta(days=30)).isoformat(),
+            "created_at": now.isoformat(),
+            "due_date": due_date or (now + timedelta(days=30)).isoformat(),
         }
 
         created_contract = create_contract_record(contract_data)
 
-        # Step 4: Cleanup prepared contract and temp PDF
-        cleanup_prepared_contract(prepare_id)
-        if pdf_path and os.path.exists(pdf_path) and TEMP_FOLDER in pdf_path:
-            cleanup_temp_files([pdf_path])
-
         return {
             "success": True,
             "contract": created_contract,
@@ -1006,6 +1350,7 @@ def finalize_contract(
         print(f"Contract finalization failed: {e}")
         import traceback
         traceback.print_exc()
+        cleanup_session_dir(os.path.join(TEMP_FOLDER, contract_id))
         return {
             "success": False,
             "error": str(e)
@@ -1025,30 +1370,28 @@ def update_contract_pdf(pdf_path: str, user_id: str, contract_id: str) -> str:
 
     print(f"📤 Updating PDF in bucket '{PDF_BUCKET}': {storage_path}")
 
-    # Read PDF file
-    with open(pdf_path, 'rb') as f:
-        pdf_data = f.read()
-
     # Use update to overwrite existing file
+    # (the open file is streamed, so the PDF is never held in memory as bytes)
     try:
-        response = supabase.storage.from_(PDF_BUCKET).update(
-            storage_path,
-            pdf_data,
-            file_options={"content-type": "application/pdf"}
-        )
+        with open(pdf_path, 'rb') as f:
+            response = supabase.storage.from_(PDF_BUCKET).update(
+                storage_path,
+                f,
+                file_options={"content-type": "application/pdf"}
+            )
     except Exception as e:
         # If update fails, try upload (file might not exist)
         print(f"⚠️ Update failed, trying upload: {e}")
-        response = supabase.storage.from_(PDF_BUCKET).upload(
-            storage_path,
-            pdf_data,
-            file_options={"content-type": "application/pdf", "upsert": "true"}
-        )
+        with open(pdf_path, 'rb') as f:
+            response = supabase.storage.from_(PDF_BUCKET).upload(
+                storage_path,
+                f,
+                file_options={"content-type": "application/pdf", "upsert": "true"}
+            )
 
     # Get public URL with cache buster
     import time
-    public_url = supabase.storage.from_(
-        PDF_BUCKET).get_public_url(storage_path)
+    public_url = _public_url(PDF_BUCKET, storage_path)
     # Add cache buster
     public_url_with_cache = f"{public_url}?t={int(time.time())}"
 
@@ -1076,21 +1419,44 @@ def update_contract_record(contract_id: str, updates: dict) -> dict:
         raise Exception("Failed to update contract record")
 
 
-def get_contract_by_id(contract_id: str) -> dict:
+def get_contract_by_id(contract_id: str, columns: str = '*') -> dict:
     """
     Fetch a contract record from Supabase by contract_id.
+    Pass a comma-separated column list to fetch only what's needed.
     Returns the contract data or None.
     """
     supabase = get_supabase_client()
 
     result = supabase.table('contracts').select(
-        '*').eq('contract_id', contract_id).execute()
+        columns).eq('contract_id', contract_id).execute()
 
     if result.data and len(result.data) > 0:
         return result.data[0]
     return None
 
 
+# Creator signature section fields carried over from form_data when the acceptor signs
+CREATOR_SIGNATURE_FIELDS = (
+    'creator_signature',
+    'creator_signature_name',
+    'creator_signature_id',
+    'creator_signature_date',
+)
+
+# Acceptor placeholders - templates use both "acceptor" and "acceptee" spellings
+# (case doesn't matter, fill_template matches placeholders case-insensitively)
+_ACCEPTOR_ALIASES = {
+    'name': ('acceptor_name', 'acceptee_name',
+             'acceptor_signature_name', 'acceptee_signature_name'),
+    'ic': ('acceptor_ic', 'acceptee_ic',
+           'acceptor_id_number', 'acceptee_id_number',
+           'acceptor_signature_id', 'acceptee_signature_id'),
+    'signature': ('acceptor_signature', 'acceptee_signature'),
+    'signing_date': ('acceptor_signing_date', 'acceptee_signing_date',
+                     'acceptor_signature_date', 'acceptee_signature_date'),
+}
+
+
 def sign_contract_acceptor(
     contract_id: str,
     acceptor_signature_base64: str,
@@ -1114,11 +1480,20 @@ def sign_contract_acceptor(
     """
     from datetime import datetime
 
+    try:
+        session_dir = create_session_dir(f"acceptor_{contract_id}")
+    except ValueError as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    cleanup_submitted = False
     try:
         print(f"✍️ Acceptor signing contract: {contract_id}")
 
-        # Step 1: Fetch existing contract
-        contract = get_contract_by_id(contract_id)
+        # Step 1: Fetch existing contract (only the columns used below)
+        contract = get_contract_by_id(
+            contract_id, 'template_type,form_data,created_user_id,pdf_url')
         if not contract:
             return {
                 "success": False,
@@ -1132,99 +1507,51 @@ def sign_contract_acceptor(
 
         print(f"📋 Contract template: {template_type}")
 
-        # Save acceptor signature to temp file
-        acceptor_sig_path = save_signature_image(
-            acceptor_signature_base64, f"acceptor_sig_{contract_id}")
-
         # Get current timestamp with date and time (YYYY-MM-DD HH:MM:SS)
         signing_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         # Step 3: Build complete placeholders with all details
-        placeholders = {**form_data}
-
-        # IMPORTANT: Preserve creator signature from form_data if it exists
-        # The creator signature should have been saved during contract creation
-        creator_sig = form_data.get(
-            'creator_signature') or form_data.get('CREATOR_SIGNATURE')
-        if creator_sig:
-            print(f"📝 Preserving creator signature from form_data")
-            placeholders['CREATOR_SIGNATURE'] = creator_sig
-            placeholders['creator_signature'] = creator_sig
-
-        # Preserve creator signature section fields (name, id, date)
-        creator_sig_name = form_data.get(
-            'creator_signature_name') or form_data.get('CREATOR_SIGNATURE_NAME')
-        creator_sig_id = form_data.get(
-            'creator_signature_id') or form_data.get('CREATOR_SIGNATURE_ID')
-        creator_sig_date = form_data.get(
-            'creator_signature_date') or form_data.get('CREATOR_SIGNATURE_DATE')
-
-        if creator_sig_name:
-            print(f"📝 Preserving creator signature name: {creator_sig_name}")
-            placeholders['creator_signature_name'] = creator_sig_name
-            placeholders['CREATOR_SIGNATURE_NAME'] = creator_sig_name
-        if creator_sig_id:
-            print(f"📝 Preserving creator signature id: {creator_sig_id}")
-            placeholders['creator_signature_id'] = creator_sig_id
-            placeholders['CREATOR_SIGNATURE_ID'] = creator_sig_id
-        if creator_sig_date:
-            print(f"📝 Preserving creator signature date: {creator_sig_date}")
-            placeholders['creator_signature_date'] = creator_sig_date
-            placeholders['CREATOR_SIGNATURE_DATE'] = creator_sig_date
-
-        # Add acceptor details - support both uppercase and lowercase
-        placeholders['ACCEPTOR_NAME'] = acceptor_name
-        placeholders['acceptor_name'] = acceptor_name
-        placeholders['ACCEPTEE_NAME'] = acceptor_name
-        placeholders['acceptee_name'] = acceptor_name
-
-        placeholders['ACCEPTOR_IC'] = acceptor_ic
-        placeholders['acceptor_ic'] = acceptor_ic
-        placeholders['ACCEPTEE_IC'] = acceptor_ic
-        placeholders['acceptee_ic'] = acceptor_ic
-        placeholders['acceptor_id_number'] = acceptor_ic
-        placeholders['acceptee_id_number'] = acceptor_ic
-
-        # Add acceptor signature
-        if acceptor_sig_path and os.path.exists(acceptor_sig_path):
-            with open(acceptor_sig_path, 'rb') as f:
-                sig_data = f.read()
-            sig_base64 = f"data:image/png;base64,{base64.b64encode(sig_data).decode()}"
-            placeholders['ACCEPTOR_SIGNATURE'] = sig_base64
-            placeholders['acceptor_signature'] = sig_base64
-            placeholders['ACCEPTEE_SIGNATURE'] = sig_base64
-            placeholders['acceptee_signature'] = sig_base64
-
-        # Add acceptor signing date
-        placeholders['ACCEPTOR_SIGNING_DATE'] = signing_timestamp
-        placeholders['acceptor_signing_date'] = signing_timestamp
-        placeholders['ACCEPTEE_SIGNING_DATE'] = signing_timestamp
-        placeholders['acceptee_signing_date'] = signing_timestamp
-
-        # Acceptee signature section fields (new placeholders from template)
-        placeholders['acceptee_signature_name'] = acceptor_name
-        placeholders['ACCEPTEE_SIGNATURE_NAME'] = acceptor_name
-        placeholders['acceptor_signature_name'] = acceptor_name
-        placeholders['ACCEPTOR_SIGNATURE_NAME'] = acceptor_name
-        placeholders['acceptee_signature_id'] = acceptor_ic
-        placeholders['ACCEPTEE_SIGNATURE_ID'] = acceptor_ic
-        placeholders['acceptor_signature_id'] = acceptor_ic
-        placeholders['ACCEPTOR_SIGNATURE_ID'] = acceptor_ic
-        placeholders['acceptee_signature_date'] = signing_timestamp
-        placeholders['ACCEPTEE_SIGNATURE_DATE'] = signing_timestamp
-        placeholders['acceptor_signature_date'] = signing_timestamp
-        placeholders['ACCEPTOR_SIGNATURE_DATE'] = signing_timestamp
+        # (CIDict: one entry serves both {{KEY}} and {{key}} in the template)
+        placeholders = CIDict(form_data)
+
+        # IMPORTANT: Preserve creator signature and signature section fields
+        # (name, id, date) saved in form_data during contract creation
+        for key in CREATOR_SIGNATURE_FIELDS:
+            value = form_data.get(key) or form_data.get(key.upper())
+            if value:
+                print(f"📝 Preserving {key} from form_data")
+                placeholders[key] = value
+
+        # Add acceptor details under every alias the templates use
+        acceptor_values = {
+            'name': acceptor_name,
+            'ic': acceptor_ic,
+            'signing_date': signing_timestamp,
+        }
+
+        # Add acceptor signature (data URL goes straight to fill_template)
+        sig_url = signature_data_url(acceptor_signature_base64)
+        if sig_url:
+            acceptor_values['signature'] = sig_url
+
+        for field, value in acceptor_values.items():
+            for key in _ACCEPTOR_ALIASES[field]:
+                placeholders[key] = value
 
         print(f"📝 Filled {len(placeholders)} placeholders")
 
         # Step 4: Download template and generate new PDF
-        doc_path = download_template(template_type)
-        filled_path = fill_template(doc_path, placeholders)
+        template_source = download_template(template_type, session_dir)
+        filled_path = fill_template(template_source, placeholders)
         pdf_path = convert_to_pdf(filled_path)
 
         # Step 5: Upload/overwrite PDF in storage
         new_pdf_url = update_contract_pdf(pdf_path, creator_id, contract_id)
 
+        # Cleanup temp files (filled .docx and PDF) while the record is updated
+        CLEANUP_EXECUTOR.submit(cleanup_session_dir, session_dir)
+        cleanup_submitted = True
+
         # Step 6: Update contract record
         # Note: acceptee_signed_at column doesn't exist in current schema
         updates = {
@@ -1236,11 +1563,6 @@ def sign_contract_acceptor(
 
         updated_contract = update_contract_record(contract_id, updates)
 
-        # Cleanup temp files
-        cleanup_temp_files([doc_path, filled_path, pdf_path])
-        if acceptor_sig_path:
-            cleanup_temp_files([acceptor_sig_path])
-
         print(f"✅ Contract signed by acceptor: {contract_id}")
 
         return {
@@ -1258,3 +1580,7 @@ def sign_contract_acceptor(
             "success": False,
             "error": str(e)
         }
+
+    finally:
+        if not cleanup_submitted:
+            cleanup_session_dir(session_dir)
@@ -3,17 +3,112 @@ import os
 import cv2
 import numpy as np
 import gc
-import time
+import json
+import base64
+import functools
+import logging
+import threading
 from deepface import DeepFace
 
-from config import MODEL_NAME, MAX_IMAGE_SIZE, UPLOAD_FOLDER, PASSING_THRESHOLD_DISTANCE, PASSING_THRESHOLD_PERCENTAGE
+# orjson parses legacy JSON embeddings several times faster; stdlib json as fallback
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
 
-# Haar cascade for face detection
+from config import MODEL_NAME, MAX_IMAGE_SIZE, PASSING_THRESHOLD_PERCENTAGE, EMBEDDING_INT8
+
+# Per-frame messages go through logging (DEBUG) instead of print
+logger = logging.getLogger(__name__)
+
+# YuNet CNN face detector (preferred); Haar cascade is the fallback
+YUNET_MODEL_PATH = os.path.join(os.path.dirname(__file__), 'face_detection_yunet_2023mar.onnx')
+_yunet = None
+# setInputSize + detect on the shared detector must not interleave across threads
+_yunet_lock = threading.Lock()
 _haar_cascade = None
+DETECT_MAX_SIZE = 640  # Longest side of the image the detector scans
+
+# DeepFace.represent with this service's fixed options bound once
+_represent = functools.partial(
+    DeepFace.represent,
+    model_name=MODEL_NAME,
+    enforce_detection=False,
+    detector_backend='opencv'
+)
 
 # Temporary IC embedding storage (for registration flow)
 _temp_ic_embedding = None
 
+# Decoded per-user embeddings: { user_id: (stored_embedding, ndarray) }
+_user_embeddings = {}
+
+# Refcounting frees each frame's arrays; a full gc sweep only every N frames
+GC_EVERY_N_FRAMES = 100
+_frames_since_gc = 0
+
+
+def normalize_embedding(embedding):
+    """L2-normalize so cosine similarity is a plain dot product"""
+    arr = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm > 0 else arr
+
+
+# Prefix marking int8-quantized embeddings in storage ("i8:" + base64 int8 bytes)
+INT8_PREFIX = 'i8:'
+
+
+def quantize_embedding(embedding):
+    """Quantize a unit-length embedding to int8 (fixed scale 127, values are in [-1, 1])"""
+    arr = normalize_embedding(embedding)
+    return np.clip(np.round(arr * 127), -127, 127).astype(np.int8)
+
+
+def encode_embedding(embedding):
+    """
+    Pack embedding for storage in Supabase: base64 float32 bytes, or
+    INT8_PREFIX + base64 int8 bytes (4x smaller) when EMBEDDING_INT8 is on.
+    """
+    if EMBEDDING_INT8:
+        return INT8_PREFIX + base64.b64encode(
+            quantize_embedding(embedding).tobytes()).decode('ascii')
+    return base64.b64encode(
+        np.asarray(embedding, dtype=np.float32).tobytes()).decode('ascii')
+
+
+@functools.lru_cache(maxsize=512)
+def _decode_stored_embedding(stored):
+    """Decode a stored embedding string once; repeat comparisons reuse the array"""
+    if stored.lstrip().startswith('['):
+        # Legacy rows: JSON list of floats
+        arr = _json_loads(stored)
+    elif stored.startswith(INT8_PREFIX):
+        # Quantized rows: dequantize once, comparisons stay float32 BLAS dots
+        arr = np.frombuffer(base64.b64decode(stored[len(INT8_PREFIX):]), dtype=np.int8)
+    else:
+        arr = np.frombuffer(base64.b64decode(stored), dtype=np.float32)
+    # Legacy rows were stored un-normalized (and int8 rows lose a little norm)
+    arr = normalize_embedding(arr)
+    arr.flags.writeable = False
+    return arr
+
+
+def decode_embedding(embedding):
+    """
+    Return embedding as a unit-length float32 ndarray (accepts base64, JSON,
+    list or ndarray). ndarrays are passed through - generate_embedding()
+    already normalizes them.
+    """
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        return _decode_stored_embedding(embedding)
+    if isinstance(embedding, np.ndarray):
+        return embedding.astype(np.float32, copy=False)
+    return normalize_embedding(embedding)
+
 
 def store_temp_embedding(embedding):
     """Store IC embedding temporarily in memory for verification"""
@@ -35,54 +130,101 @@ def clear_temp_embedding():
 
 
 def compare_embeddings(embedding1, embedding2):
-    """Compare two embeddings and return (is_match, score, distance)"""
-    import json
-    
+    """
+    Compare two embeddings and return (is_match, score, distance).
+    Uses cosine similarity on unit-length vectors; distance is 1 - similarity.
+    """
     if embedding1 is None or embedding2 is None:
         return False, 0, float('inf')
-    
-    # Handle string embeddings (from Supabase JSON)
-    if isinstance(embedding1, str):
-        try:
-            embedding1 = json.loads(embedding1)
-        except json.JSONDecodeError:
-            print(f"⚠️ Failed to parse embedding1 as JSON")
-            return False, 0, float('inf')
-    
-    if isinstance(embedding2, str):
-        try:
-            embedding2 = json.loads(embedding2)
-        except json.JSONDecodeError:
-            print(f"⚠️ Failed to parse embedding2 as JSON")
-            return False, 0, float('inf')
-    
-    # Calculate Euclidean distance
-    arr1 = np.array(embedding1, dtype=np.float64)
-    arr2 = np.array(embedding2, dtype=np.float64)
-    distance = np.linalg.norm(arr1 - arr2)
-    
-    # Calculate score (same formula as before)
-    max_score_dist = PASSING_THRESHOLD_DISTANCE * 2
-    raw_score = ((max_score_dist - distance) / max_score_dist) * 100
-    score = round(max(0, min(100, raw_score)))
+
+    # Stored embeddings (base64 float32, or legacy JSON) are decoded once and cached
+    try:
+        arr1 = decode_embedding(embedding1)
+        arr2 = decode_embedding(embedding2)
+    except ValueError:
+        logger.warning("⚠️ Failed to decode stored embedding")
+        return False, 0, float('inf')
+
+    if arr1.shape != arr2.shape:
+        logger.warning("⚠️ Embedding size mismatch: %s vs %s", arr1.shape, arr2.shape)
+        return False, 0, float('inf')
+
+    # Cosine similarity: a single BLAS dot, no temporaries
+    similarity = float(np.dot(arr1, arr2))
+    distance = 1.0 - similarity
+
+    # Map similarity [-1, 1] to score [0, 100]
+    score = round(max(0, min(100, (similarity + 1) * 50)))
     
     is_match = score >= PASSING_THRESHOLD_PERCENTAGE
     
-    print(f"📊 Comparison: Distance={distance:.2f}, Score={score}%, Match={is_match}")
+    logger.debug("📊 Comparison: Distance=%.2f, Score=%s%%, Match=%s", distance, score, is_match)
     return is_match, score, distance
 
 
+def get_user_embedding(user_id, stored_embedding):
+    """Decoded embedding for a user, re-decoded only when the stored value changes"""
+    cached = _user_embeddings.get(user_id)
+    if cached is None or cached[0] != stored_embedding:
+        cached = (stored_embedding, decode_embedding(stored_embedding))
+        _user_embeddings[user_id] = cached
+    return cached[1]
+
+
+def compare_embedding_batch(probe, candidates):
+    """
+    Cosine similarity of one probe against an (N, D) matrix of unit-length
+    candidate embeddings. One matrix-vector product instead of N calls.
+    Returns an (N,) float32 array of similarities.
+    """
+    return candidates @ decode_embedding(probe)
+
+
+def find_best_match(probe, users):
+    """
+    Find the user whose stored face_embedding best matches the probe.
+    Returns (matched_user or None, best_score, best_distance).
+    """
+    probe = decode_embedding(probe)
+
+    candidates = []
+    gallery = []
+    for user in users:
+        stored_embedding = user.get('face_embedding')
+        if not stored_embedding:
+            continue
+        try:
+            embedding = get_user_embedding(user.get('user_id'), stored_embedding)
+        except ValueError:
+            logger.warning("⚠️ Failed to decode embedding for user %s", user.get('user_id'))
+            continue
+        if embedding.shape != probe.shape:
+            continue
+        candidates.append(user)
+        gallery.append(embedding)
+
+    if not candidates:
+        return None, 0, float('inf')
+
+    similarities = compare_embedding_batch(probe, np.stack(gallery))
+    best = int(np.argmax(similarities))
+    similarity = float(similarities[best])
+    score = round(max(0, min(100, (similarity + 1) * 50)))
+    is_match = score >= PASSING_THRESHOLD_PERCENTAGE
+
+    logger.debug("📊 Best of %d: Distance=%.2f, Score=%s%%, Match=%s",
+                 len(candidates), 1.0 - similarity, score, is_match)
+    return (candidates[best] if is_match else None), score, 1.0 - similarity
+
+
 def warmup():
     """Warmup DeepFace model (call once on startup)"""
     print("⏳ Warming up DeepFace AI... (This runs once)")
     try:
+        # The first represent() builds the model into DeepFace's own per-process
+        # cache; later calls reuse it as long as the Keras session isn't cleared
         test_img = np.zeros((100, 100, 3), dtype=np.uint8)
-        DeepFace.represent(
-            img_path=test_img,
-            model_name=MODEL_NAME,
-            enforce_detection=False,
-            detector_backend='opencv'
-        )
+        _represent(img_path=test_img)
         del test_img
         gc.collect()
         print("✅ AI Ready!")
@@ -92,6 +234,20 @@ def warmup():
         return False
 
 
+def get_yunet():
+    """Get or initialize the YuNet face detector, None if the model isn't available"""
+    global _yunet
+    if _yunet is None:
+        _yunet = False
+        if os.path.exists(YUNET_MODEL_PATH) and hasattr(cv2, 'FaceDetectorYN'):
+            try:
+                _yunet = cv2.FaceDetectorYN.create(YUNET_MODEL_PATH, '', (320, 320), 0.6, 0.3, 5000)
+                print("✅ YuNet face detector loaded")
+            except cv2.error as e:
+                print(f"⚠️ YuNet unavailable, using Haar cascade: {e}")
+    return _yunet or None
+
+
 def get_haar_cascade():
     """Get or initialize Haar cascade classifier"""
     global _haar_cascade
@@ -111,7 +267,8 @@ def resize_image(img_path_or_array, max_size=MAX_IMAGE_SIZE, min_size=320):
     if isinstance(img_path_or_array, str):
         img = cv2.imread(img_path_or_array)
     else:
-        img = img_path_or_array.copy()
+        # cv2.resize returns a new array, callers never modify an unresized frame
+        img = img_path_or_array
 
     if img is None:
         return img_path_or_array
@@ -122,38 +279,41 @@ def resize_image(img_path_or_array, max_size=MAX_IMAGE_SIZE, min_size=320):
 
     if max_dim > max_size:
         scale = max_size / max_dim
-        new_width = int(width * scale)
-        new_height = int(height * scale)
-        if min(new_width, new_height) < min_size:
+        if min_dim * scale < min_size:
             scale = min_size / min_dim
-            new_width = int(width * scale)
-            new_height = int(height * scale)
-        img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
     return img
 
 
 def detect_face(frame):
-    """Detect faces in frame using Haar cascade, returns list of face coordinates"""
-    haar_cascade = get_haar_cascade()
-    if haar_cascade.empty():
-        return []
+    """Detect faces in frame (YuNet, falling back to Haar cascade), returns list of (x, y, w, h)"""
+    # Detection doesn't need full resolution - scan a smaller copy
+    scale = min(1.0, DETECT_MAX_SIZE / max(frame.shape[:2]))
+    if scale < 1.0:
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        small = frame
+
+    yunet = get_yunet()
+    if yunet is not None:
+        height, width = small.shape[:2]
+        with _yunet_lock:
+            yunet.setInputSize((width, height))
+            _, detections = yunet.detect(small)
+        if detections is None:
+            return []
+        # Rows are [x, y, w, h, 5 landmarks..., score]; callers only need the box
+        faces = detections[:, :4].astype(int)
+    else:
+        haar_cascade = get_haar_cascade()
+        if haar_cascade.empty():
+            return []
 
-    gray_img = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    
-    # Attempt 1: Lenient
-    min_face_size = max(15, min(frame.shape[1], frame.shape[0]) // 20)
-    faces = haar_cascade.detectMultiScale(
-        gray_img,
-        scaleFactor=1.05,
-        minNeighbors=1,
-        minSize=(min_face_size, min_face_size),
-        flags=cv2.CASCADE_SCALE_IMAGE
-    )
-
-    # Attempt 2: More lenient
-    if len(faces) == 0:
-        min_face_size = max(10, min(frame.shape[1], frame.shape[0]) // 30)
+        gray_img = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        # Single lenient pass (finds a superset of what a stricter pass would)
+        min_face_size = max(10, min(gray_img.shape[:2]) // 30)
         faces = haar_cascade.detectMultiScale(
             gray_img,
             scaleFactor=1.03,
@@ -162,13 +322,14 @@ def detect_face(frame):
             flags=cv2.CASCADE_SCALE_IMAGE
         )
 
-    del gray_img
-    gc.collect()
+    # Map back to full-resolution frame coordinates
+    if scale < 1.0 and len(faces) > 0:
+        faces = (faces / scale).astype(int)
     return faces
 
 
 def crop_face(frame, face_coords, padding=50):
-    """Crop face region from frame with padding, returns file path to cropped image"""
+    """Crop face region from frame with padding, returns the cropped BGR image"""
     x, y, w, h = face_coords
     
     # Add padding
@@ -181,73 +342,41 @@ def crop_face(frame, face_coords, padding=50):
     if x < 0 or y < 0 or x + w > frame.shape[1] or y + h > frame.shape[0]:
         raise ValueError(f"Invalid crop: x={x}, y={y}, w={w}, h={h}")
 
-    face_crop = frame[y:y+h, x:x+w]
-    crop_path = os.path.join(UPLOAD_FOLDER, f"face_crop_{int(time.time())}.jpg")
-    cv2.imwrite(crop_path, face_crop)
-    
-    del face_crop
-    gc.collect()
-    return crop_path
+    return frame[y:y+h, x:x+w]
 
 
 def generate_embedding(img_input):
-    """Generate 512-dimensional face embedding from image"""
-    temp_path = None
+    """
+    Generate 512-dimensional face embedding from image.
+    Accepts a file path or a BGR ndarray (OpenCV order), which is handed
+    to DeepFace directly without a temp file.
+    """
     try:
         if isinstance(img_input, np.ndarray):
-            temp_path = os.path.join(UPLOAD_FOLDER, f"temp_embed_{int(time.time())}.jpg")
-            if len(img_input.shape) == 3 and img_input.shape[2] == 3:
-                bgr_img = cv2.cvtColor(img_input, cv2.COLOR_RGB2BGR)
-            else:
-                bgr_img = img_input
-            cv2.imwrite(temp_path, bgr_img)
-            processed_img = temp_path
+            processed_img = img_input
         else:
             processed_img = resize_image(img_input)
 
-        print("🔍 Generating face embedding...")
-        embedding_obj = DeepFace.represent(
-            img_path=processed_img,
-            model_name=MODEL_NAME,
-            enforce_detection=False,
-            detector_backend='opencv'
-        )
-
-        embedding = embedding_obj[0]["embedding"]
-        print(f"✅ Embedding generated (length: {len(embedding)})")
-
-        # Cleanup temp file
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
+        logger.debug("🔍 Generating face embedding...")
+        embedding_obj = _represent(img_path=processed_img)
 
-        # Clear TensorFlow/Keras memory to prevent buildup
-        try:
-            from tensorflow.keras import backend as K
-            K.clear_session()
-        except:
-            pass
-        
-        gc.collect()
+        embedding = normalize_embedding(embedding_obj[0]["embedding"])
+        logger.debug("✅ Embedding generated (length: %d)", len(embedding))
         return embedding
 
     except Exception as e:
-        print(f"Error generating embedding: {e}")
-        import traceback
-        traceback.print_exc()
-        if temp_path and os.path.exists(temp_path):
-            try:
-                os.remove(temp_path)
-            except:
-                pass
-        gc.collect()
+        logger.exception("Error generating embedding: %s", e)
         raise
 
 
 def process_frame_for_embedding(frame):
     """Process a video frame and return face embedding or None"""
+    global _frames_since_gc
+    _frames_since_gc += 1
+    if _frames_since_gc >= GC_EVERY_N_FRAMES:
+        _frames_since_gc = 0
+        gc.collect()
+
     # Resize if needed
     if max(frame.shape[:2]) > MAX_IMAGE_SIZE:
         frame = resize_image(frame)
@@ -257,18 +386,8 @@ def process_frame_for_embedding(frame):
 
     if len(faces) == 0:
         # Use entire frame, let DeepFace detect internally
-        rgb_face = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        return generate_embedding(rgb_face)
+        return generate_embedding(frame)
     else:
         # Get largest face
         largest_face = max(faces, key=lambda f: f[2] * f[3])
-        crop_path = crop_face(frame, largest_face)
-        try:
-            embedding = generate_embedding(crop_path)
-            return embedding
-        finally:
-            if os.path.exists(crop_path):
-                try:
-                    os.remove(crop_path)
-                except:
-                    pass
+        return generate_embedding(crop_face(frame, largest_face))
@@ -1,7 +1,7 @@
 # OCR Service for Malaysian IC Extraction
 import cv2
 import re
-import gc
+import logging
 
 try:
     import easyocr
@@ -10,9 +10,28 @@ except ImportError:
     EASYOCR_AVAILABLE = False
     print("⚠️ EasyOCR not available. Install with: pip install easyocr")
 
+# Per-scan messages go through logging (DEBUG) instead of print
+logger = logging.getLogger(__name__)
+
 # Module-level OCR reader (lazy loading)
 _ocr_reader = None
 
+# IC parsing patterns, compiled once
+_IC_RE = re.compile(r'\b\d{6}-\d{2}-\d{4}\b')  # YYMMDD-PB-G###
+_WS_RE = re.compile(r'\s+')
+
+# A name line: no card-label or address words, optional title (not captured),
+# then 2+ words of letters only - so IC numbers and other digit lines never match.
+# Scanned once over all OCR lines joined with newlines.
+_NAME_RE = re.compile(
+    r"^(?!.*\b(?:MALAYSIA|KAD|PENGENALAN|IDENTITY|CARD|JALAN|JLN|TAMAN|KAMPUNG|KG|LOT)\b)"
+    r"(?:(?:MR|MRS|MS|DR|PROF|TAN SRI|DATUK|DATO|TUAN|PUAN) +)?"
+    r"([A-Z][A-Z'/@.-]*(?: +[A-Z'/@.-]+)+)$",
+    re.MULTILINE
+)
+
+ADDRESS_KEYWORDS = ('JALAN', 'JLN', 'TAMAN', 'KAMPUNG', 'KG', 'LOT', 'NO')
+
 
 def init_reader():
     """Initialize EasyOCR reader with GPU fallback"""
@@ -30,17 +49,13 @@ def init_reader():
 
 
 def resize_for_ocr(image_path, max_size=1200):
-    """Resize image if too large for faster OCR processing"""
+    """Load image, shrinking it if too large for faster OCR. Returns the ndarray (None if unreadable)"""
     img = cv2.imread(image_path)
     if img is not None and max(img.shape[:2]) > max_size:
         scale = max_size / max(img.shape[:2])
         img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-        cv2.imwrite(image_path, img)
-        print(f"📏 Image resized to {img.shape[1]}x{img.shape[0]} for faster OCR")
-        del img
-        gc.collect()
-        return True
-    return False
+        logger.debug("📏 Image resized to %dx%d for faster OCR", img.shape[1], img.shape[0])
+    return img
 
 
 def extract_ic_details(image_path):
@@ -53,17 +68,17 @@ def extract_ic_details(image_path):
         if reader is None:
             return {"error": "Failed to initialize OCR reader"}
 
-        print("🔍 Running OCR on IC image...")
-        resize_for_ocr(image_path)
-        
-        results = reader.readtext(image_path)
+        logger.debug("🔍 Running OCR on IC image...")
+        img = resize_for_ocr(image_path)
+
+        # EasyOCR takes the decoded array directly - no write-back/re-read
+        results = reader.readtext(img if img is not None else image_path)
         full_text = ' '.join([result[1] for result in results])
 
         extracted = {}
 
         # IC Number pattern: YYMMDD-PB-G###
-        ic_pattern = r'\b\d{6}-\d{2}-\d{4}\b'
-        ic_match = re.search(ic_pattern, full_text)
+        ic_match = _IC_RE.search(full_text)
         if ic_match:
             extracted['icNumber'] = ic_match.group(0)
             dob_str = ic_match.group(0).split('-')[0]
@@ -75,85 +90,34 @@ def extract_ic_details(image_path):
                 extracted['dateOfBirth'] = f"{full_year}-{month}-{day}"
                 extracted['gender'] = 'Male' if int(ic_match.group(0).split('-')[2][-1]) % 2 == 1 else 'Female'
 
-        # Name extraction with multiple strategies
-        lines = [result[1] for result in results]
-        lines_with_positions = [(result[0], result[1]) for result in results]
+        # Name extraction: one scan over all lines (upper-cased, whitespace collapsed)
+        lines = [_WS_RE.sub(' ', result[1]).strip().upper() for result in results]
+        joined = '\n'.join(lines)
+        name_candidates = [(joined.count('\n', 0, m.start()), m.group(1))
+                           for m in _NAME_RE.finditer(joined) if len(m.group(1)) > 5]
 
+        # On a MyKad the name is printed right below the IC number
         ic_line_index = -1
-        for i, line in enumerate(lines):
-            if ic_match and ic_match.group(0) in line:
-                ic_line_index = i
-                break
-
-        name_candidates = []
-
-        # Strategy 1: Text before IC number
-        if ic_line_index > 0:
-            for i in range(max(0, ic_line_index - 5), ic_line_index):
-                candidate = lines[i].strip()
-                if (candidate and len(candidate) > 3 and
-                    not re.match(r'^\d', candidate) and
-                    not re.match(r'^[A-Z]{1,2}\d', candidate) and
-                    'MALAYSIA' not in candidate.upper() and
-                    'KAD' not in candidate.upper() and
-                    'PENGENALAN' not in candidate.upper() and
-                    len(candidate.split()) >= 2):
-                    name_candidates.append((i, candidate, 'before_ic'))
-
-        # Strategy 2: Position-based (top of card)
-        if lines_with_positions:
-            try:
-                sorted_by_y = sorted(lines_with_positions, 
-                    key=lambda x: x[0][0][1] if len(x[0]) > 0 and len(x[0][0]) > 1 else 9999)
-                for idx, (bbox, text) in enumerate(sorted_by_y[:8]):
-                    text_clean = text.strip()
-                    if (text_clean and len(text_clean) > 3 and
-                        not re.match(r'^\d', text_clean) and
-                        'MALAYSIA' not in text_clean.upper() and
-                        len(text_clean.split()) >= 2):
-                        name_candidates.append((idx, text_clean, 'position_top'))
-                        if len([c for c in name_candidates if c[2] == 'position_top']) >= 3:
-                            break
-            except Exception as e:
-                print(f"⚠️ Position detection error: {e}")
-
-        # Strategy 3: All caps names
-        for i, line in enumerate(lines):
-            text_clean = line.strip()
-            if (text_clean and len(text_clean) > 5 and text_clean.isupper() and
-                len(text_clean.split()) >= 2 and not re.match(r'^\d', text_clean) and
-                'MALAYSIA' not in text_clean and
-                ic_match and ic_match.group(0) not in text_clean):
-                name_candidates.append((i, text_clean, 'all_caps'))
-                break
-
-        # Select best candidate
+        if ic_match:
+            ic_line_index = next((i for i, line in enumerate(lines) if ic_match.group(0) in line), -1)
+
+        # Select best candidate: the earliest line after the IC number (lines
+        # above it only if there are none), then most words, then longest
         if name_candidates:
-            print(f"📝 Name candidates: {[c[1] for c in name_candidates]}")
-            all_caps = [c for c in name_candidates if c[2] == 'all_caps']
-            if all_caps:
-                best_name = max(all_caps, key=lambda x: (len(x[1].split()), len(x[1])))
-            else:
-                best_name = max(name_candidates, key=lambda x: (len(x[1].split()), len(x[1])))
-            
-            best_name_text = re.sub(r'\s+', ' ', best_name[1]).strip()
-            best_name_text = re.sub(
-                r'^(MR|MRS|MS|DR|PROF|TAN SRI|DATUK|DATO|TUAN|PUAN)\s+', 
-                '', best_name_text, flags=re.IGNORECASE
-            ).strip()
-            extracted['name'] = best_name_text
+            logger.debug("📝 Name candidates: %s", [name for _, name in name_candidates])
+            _, extracted['name'] = min(
+                name_candidates,
+                key=lambda c: (c[0] < ic_line_index, c[0] if c[0] > ic_line_index else -c[0],
+                               -(c[1].count(' ') + 1), -len(c[1])))
 
         # Address extraction
-        address_keywords = ['JALAN', 'JLN', 'TAMAN', 'KAMPUNG', 'KG', 'LOT', 'NO']
-        address_lines = [line.strip() for line in lines 
-                        if any(kw in line.upper() for kw in address_keywords)]
+        address_lines = [result[1].strip() for result, upper in zip(results, lines)
+                         if any(kw in upper for kw in ADDRESS_KEYWORDS)]
         if address_lines:
             extracted['address'] = ', '.join(address_lines[:3])
 
         return extracted
 
     except Exception as e:
-        print(f"❌ OCR Error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ OCR Error: %s", e)
         return {"error": str(e)}
@@ -4,9 +4,152 @@ Adds highlight annotations to PDF documents based on text matching.
 Uses PyMuPDF (fitz) for PDF manipulation.
 """
 
+import bisect
 import fitz  # PyMuPDF
+import hashlib
+import json
+import logging
 import os
+import re
+import shutil
 import tempfile
+import time
+
+# Optional: one Aho-Corasick pass per page finds every annotation's candidate
+# pages at once; without it each probe is a plain substring check
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except ImportError:
+    AHOCORASICK_AVAILABLE = False
+
+# Text extraction flags page.search_for() uses when it builds its own textpage
+# (joins hyphenated words); cached textpages must match to find the same text
+SEARCH_TEXT_FLAGS = (
+    fitz.TEXT_DEHYPHENATE
+    | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_PRESERVE_LIGATURES
+    | fitz.TEXT_MEDIABOX_CLIP
+)
+
+_WS_RE = re.compile(r'\s+')
+_WORD_RE = re.compile(r'\w+')
+
+# Fuzzy fallback: the first FUZZY_TOKEN_COUNT content words (3+ letters, not
+# stop words) of the text are looked for in order as whole words; the window
+# they span is searched if it's short enough
+FUZZY_TOKEN_COUNT = 8
+FUZZY_MIN_TOKENS = 3
+FUZZY_MAX_WINDOW = 300
+# English and Malay function words - they occur everywhere, so they can't anchor a match
+FUZZY_STOP_WORDS = frozenset({
+    'the', 'and', 'for', 'are', 'was', 'were', 'with', 'that', 'this', 'these',
+    'those', 'from', 'into', 'onto', 'upon', 'such', 'any', 'all', 'each', 'its',
+    'their', 'there', 'which', 'who', 'whom', 'whose', 'shall', 'will', 'may',
+    'must', 'not', 'but', 'has', 'have', 'had', 'been', 'being', 'other', 'than',
+    'then', 'under', 'hereby', 'herein', 'thereof', 'dan', 'yang', 'untuk',
+    'dengan', 'atau', 'ini', 'itu', 'pada', 'dalam', 'oleh', 'akan', 'kepada',
+    'bagi', 'tidak', 'adalah', 'dari', 'daripada', 'ke', 'di', 'juga',
+})
+
+# Per-annotation match details go through logging (DEBUG) instead of print
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# HIGHLIGHTED PDF CACHE - identical previews are served from disk
+# ============================================
+# Files are shared by all worker processes: {key}.pdf plus {key}.json metadata
+HIGHLIGHT_CACHE_FOLDER = "highlight_cache"
+os.makedirs(HIGHLIGHT_CACHE_FOLDER, exist_ok=True)
+HIGHLIGHT_CACHE_EXPIRY_SECONDS = 3600  # 1 hour, same as the template cache
+
+
+def highlight_cache_key(template_name: str, placeholders: dict, annotations: list) -> str:
+    """BLAKE2b fingerprint of everything that determines the highlighted PDF"""
+    payload = json.dumps(
+        {"template": template_name, "placeholders": placeholders, "annotations": annotations},
+        sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _highlight_cache_paths(key: str) -> tuple:
+    base = os.path.join(HIGHLIGHT_CACHE_FOLDER, key)
+    return f"{base}.pdf", f"{base}.json"
+
+
+def get_cached_highlight(key: str):
+    """
+    Get a cached highlighted PDF if available and not expired.
+    Returns the cached result dict, or None on a miss.
+    """
+    pdf_path, meta_path = _highlight_cache_paths(key)
+    try:
+        age = time.time() - os.path.getmtime(meta_path)
+        if age >= HIGHLIGHT_CACHE_EXPIRY_SECONDS:
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Checked after the meta: eviction removes the meta first, the PDF second
+    if not os.path.exists(pdf_path):
+        return None
+
+    print(f"✅ Highlight cache HIT: {key} (age: {age:.1f}s)")
+    return {**meta, "pdf_path": pdf_path}
+
+
+def set_cached_highlight(key: str, highlighted_path: str, meta: dict) -> str:
+    """
+    Move a freshly highlighted PDF into the cache (atomic rename) with its
+    metadata, dropping expired entries. Returns the cached PDF path.
+    """
+    pdf_path, meta_path = _highlight_cache_paths(key)
+    os.replace(highlighted_path, pdf_path)
+
+    temp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(temp_meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(temp_meta_path, meta_path)
+
+    # Drop expired entries so the folder doesn't grow without bound.
+    # An entry expires with its meta, which is removed before its PDF so a
+    # concurrent lookup never sees valid meta for a deleted file.
+    now = time.time()
+    for name in os.listdir(HIGHLIGHT_CACHE_FOLDER):
+        if not name.endswith('.json'):
+            continue
+        expired_pdf, expired_meta = _highlight_cache_paths(name[:-len('.json')])
+        try:
+            if now - os.path.getmtime(expired_meta) >= HIGHLIGHT_CACHE_EXPIRY_SECONDS:
+                os.remove(expired_meta)
+                os.remove(expired_pdf)
+        except OSError:
+            pass
+
+    # Leftovers without meta (failed writes) once they are old enough
+    for name in os.listdir(HIGHLIGHT_CACHE_FOLDER):
+        path = os.path.join(HIGHLIGHT_CACHE_FOLDER, name)
+        if name.endswith('.json') or os.path.exists(os.path.splitext(path)[0] + '.json'):
+            continue
+        try:
+            if now - os.path.getmtime(path) >= HIGHLIGHT_CACHE_EXPIRY_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+    return pdf_path
+
+
+def clear_highlight_cache():
+    """Clear all cached highlighted PDFs (useful for admin/debug)."""
+    for name in os.listdir(HIGHLIGHT_CACHE_FOLDER):
+        try:
+            os.remove(os.path.join(HIGHLIGHT_CACHE_FOLDER, name))
+        except OSError:
+            pass
+    print("🗑️ Highlight cache cleared")
 
 
 def get_highlight_color(importance_level: str) -> tuple:
@@ -22,6 +165,140 @@ def get_highlight_color(importance_level: str) -> tuple:
     return colors.get(importance_level, (1.0, 1.0, 0.5))  # Default yellow
 
 
+def get_search_variants(text_to_find: str) -> list:
+    """
+    Search strings to try for one annotation, longest first.
+    Every variant is a prefix of the text (full text, first 80/50 chars,
+    first 10/5/3 words), at least 5 characters each. Variants differing only
+    in case or whitespace are one search for search_for(), so they're
+    deduplicated on their normalized form.
+    """
+    search_variants = [
+        text_to_find,                                    # Original
+        text_to_find[:80],                               # First 80 chars
+        text_to_find[:50],                               # First 50 chars
+        ' '.join(text_to_find.split()[:10]),             # First 10 words
+        ' '.join(text_to_find.split()[:5]),              # First 5 words
+        ' '.join(text_to_find.split()[:3]),              # First 3 words
+    ]
+
+    # Remove duplicates while preserving order
+    seen = set()
+    unique_variants = []
+    for v in search_variants:
+        v_clean = v.strip()
+        key = normalize_search_text(v_clean)
+        if len(v_clean) >= 5 and key not in seen:
+            seen.add(key)
+            unique_variants.append(v_clean)
+    return unique_variants
+
+
+def normalize_search_text(text: str) -> str:
+    """Lowercase and collapse whitespace - search_for is case-insensitive and spans line breaks"""
+    return _WS_RE.sub(' ', text).strip().lower()
+
+
+def find_candidate_pages(probes: dict, page_texts: list) -> dict:
+    """
+    Find the pages whose (normalized) text contains each probe.
+    probes: { key: normalized probe text }, page_texts: normalized text per page.
+    Returns { key: set of page numbers }.
+    """
+    candidates = {key: set() for key in probes}
+    if not probes:
+        return candidates
+
+    if AHOCORASICK_AVAILABLE:
+        # One automaton over all probes, one linear scan per page
+        keys_by_probe = {}
+        for key, probe in probes.items():
+            keys_by_probe.setdefault(probe, []).append(key)
+        automaton = ahocorasick.Automaton()
+        for probe, keys in keys_by_probe.items():
+            automaton.add_word(probe, keys)
+        automaton.make_automaton()
+
+        for page_num, text in enumerate(page_texts):
+            for _, keys in automaton.iter(text):
+                for key in keys:
+                    candidates[key].add(page_num)
+    else:
+        for key, probe in probes.items():
+            for page_num, text in enumerate(page_texts):
+                if probe in text:
+                    candidates[key].add(page_num)
+
+    return candidates
+
+
+def get_fuzzy_tokens(text_to_find: str) -> list:
+    """Content words for the fuzzy fallback, or [] if there are too few to be reliable"""
+    tokens = [w for w in _WORD_RE.findall(text_to_find.lower())
+              if len(w) >= 3 and w not in FUZZY_STOP_WORDS]
+    tokens = tokens[:FUZZY_TOKEN_COUNT]
+    return tokens if len(tokens) >= FUZZY_MIN_TOKENS else []
+
+
+def get_page_words(text: str) -> list:
+    """(word, start, end) for every word of a normalized page text"""
+    return [(m.group(), m.start(), m.end()) for m in _WORD_RE.finditer(text)]
+
+
+def fuzzy_find_window(tokens: list, words: list):
+    """
+    FuzzyMatchV1-style scan over the page's word list: walk forward to the
+    leftmost occurrence of each token in order (the earliest possible end),
+    then backward from there to the tightest start. Tokens only match whole
+    words; gaps between them - punctuation, line breaks, reworded filler -
+    don't matter. Returns (start, end) character offsets or None.
+    """
+    i = 0
+    for token in tokens:
+        while i < len(words) and words[i][0] != token:
+            i += 1
+        if i == len(words):
+            return None
+        i += 1
+    end = words[i - 1][2]
+
+    i -= 1
+    for token in reversed(tokens):
+        while words[i][0] != token:
+            i -= 1
+        i -= 1
+    return words[i + 1][1], end
+
+
+def build_text_index(page_texts: list) -> tuple:
+    """
+    Join the (normalized) page texts into one string for whole-document
+    lookups. Pages are separated by a newline, which normalized search text
+    never contains, so no match can span two pages.
+    Returns (doc_text, page_offsets) - page_offsets[n] is where page n starts.
+    """
+    page_offsets = []
+    offset = 0
+    for text in page_texts:
+        page_offsets.append(offset)
+        offset += len(text) + 1
+    return '\n'.join(page_texts), page_offsets
+
+
+def find_text_pages(key: str, doc_text: str, page_offsets: list) -> list:
+    """Page numbers (ascending) whose normalized text contains key"""
+    pages = []
+    pos = doc_text.find(key)
+    while pos != -1:
+        page_num = bisect.bisect_right(page_offsets, pos) - 1
+        pages.append(page_num)
+        # One hit per page is enough - continue from the next page
+        if page_num + 1 >= len(page_offsets):
+            break
+        pos = doc_text.find(key, page_offsets[page_num + 1])
+    return pages
+
+
 def add_highlights_to_pdf(pdf_path: str, annotations: list, output_path: str = None) -> dict:
     """
     Add highlight annotations to a PDF based on text matches.
@@ -29,10 +306,62 @@ def add_highlights_to_pdf(pdf_path: str, annotations: list, output_path: str = N
     Returns page numbers for each annotation to enable navigation.
     """
     try:
-        doc = fitz.open(pdf_path)
+        if output_path is None:
+            output_path = pdf_path.replace('.pdf', '_highlighted.pdf')
+
+        # Work on a copy of the source: the highlights are then appended as an
+        # incremental update instead of re-serialising every page of the PDF
+        if os.path.abspath(output_path) != os.path.abspath(pdf_path):
+            shutil.copyfile(pdf_path, output_path)
+
+        doc = fitz.open(output_path)
         highlights_added = 0
         skipped = 0
         annotations_with_pages = []  # Track page numbers for each annotation
+
+        # Extract each page's text layout once; every search_for() reuses it
+        # instead of re-parsing the page for every variant of every annotation.
+        # The Page is kept too - a textpage only holds a weak reference to it.
+        # Searches stay on this thread: PyMuPDF documents that it is not
+        # thread-safe, so pages can't be searched from a thread pool.
+        textpages = []  # [(page, textpage)] by page number
+        page_texts = []  # normalized plain text by page number
+        for page in doc:
+            textpage = page.get_textpage(flags=SEARCH_TEXT_FLAGS)
+            textpages.append((page, textpage))
+            page_texts.append(normalize_search_text(page.get_text("text", textpage=textpage)))
+
+        # Every variant is a prefix of the text, so the shortest one is an
+        # existence check: a page without it can't contain any other variant.
+        # All annotations' probes are matched against the page text in one pass.
+        variants_by_idx = {}
+        for idx, annotation in enumerate(annotations):
+            text_to_find = annotation.get('highlighted_text', '')
+            variants = get_search_variants(text_to_find) if text_to_find else []
+            if variants:
+                variants_by_idx[idx] = variants
+        candidate_pages = find_candidate_pages(
+            {idx: normalize_search_text(min(variants, key=len))
+             for idx, variants in variants_by_idx.items()},
+            page_texts)
+
+        # Whole-document index: each variant is located with one C-level
+        # str.find over the document instead of a containment test per page
+        doc_text, page_offsets = build_text_index(page_texts)
+        page_count = len(textpages)
+
+        # Annotations usually follow the document order, so each search starts
+        # on the page where the previous annotation was found
+        last_found_page = 0
+
+        # Quads are collected per (page, color, tooltip) during the search and
+        # written afterwards as one highlight annotation (one update()) per group
+        batches = {}  # { (page_num, color, tooltip): [quads] }
+
+        # The AI often flags the same sentence twice: matches are remembered
+        # by normalized text so a repeat reuses the quads without searching
+        match_cache = {}  # { normalized text_to_find: (search_text, page_num, quads) }
+        page_words = {}  # { page_num: [(word, start, end)] } - built when the fuzzy fallback needs it
         
         for idx, annotation in enumerate(annotations):
             text_to_find = annotation.get('highlighted_text', '')
@@ -49,69 +378,90 @@ def add_highlights_to_pdf(pdf_path: str, annotations: list, output_path: str = N
             found = False
             found_page = None
             
-            # Try multiple search strategies
-            search_variants = [
-                text_to_find,                                    # Original
-                text_to_find[:80],                               # First 80 chars
-                text_to_find[:50],                               # First 50 chars
-                ' '.join(text_to_find.split()[:10]),             # First 10 words
-                ' '.join(text_to_find.split()[:5]),              # First 5 words
-                ' '.join(text_to_find.split()[:3]),              # First 3 words
-            ]
-            
-            # Remove duplicates while preserving order
-            seen = set()
-            unique_variants = []
-            for v in search_variants:
-                v_clean = v.strip()
-                if v_clean and v_clean not in seen and len(v_clean) >= 5:
-                    seen.add(v_clean)
-                    unique_variants.append(v_clean)
-            
-            for search_text in unique_variants:
-                if found:
-                    break
-                    
-                for page_num in range(len(doc)):
-                    page = doc[page_num]
-                    
-                    # Try case-insensitive search
-                    text_instances = page.search_for(search_text, quads=True)
-                    
+            unique_variants = variants_by_idx.get(idx, [])
+
+            match_key = normalize_search_text(text_to_find)
+            best = match_cache.get(match_key)  # (search_text, page_num, quads)
+            # Text inside an earlier match is searched from that match's page
+            start_page = next((hit[1] for cached, hit in match_cache.items() if match_key in cached),
+                              last_found_page)
+            # A page without the shortest variant can't contain any other one
+            if best is None and candidate_pages.get(idx):
+                # Try case-insensitive search, longest variant first; only the
+                # pages whose text contains the variant get a MuPDF search
+                for variant_idx, search_text in enumerate(unique_variants):
+                    pages = find_text_pages(normalize_search_text(search_text), doc_text, page_offsets)
+                    pages.sort(key=lambda n: (n - start_page) % page_count)
+                    for page_num in pages:
+                        page, textpage = textpages[page_num]
+                        text_instances = page.search_for(search_text, quads=True, textpage=textpage)
+                        if text_instances:
+                            best = (search_text, page_num, text_instances)
+                            break
+                    if best is not None:
+                        break
+
+            # Fallback when no variant matched (reworded punctuation, a line
+            # break inside the first words...): find the words in order
+            tokens = get_fuzzy_tokens(text_to_find) if best is None else []
+            if tokens:
+                for offset in range(page_count):
+                    page_num = (start_page + offset) % page_count
+                    if page_num not in page_words:
+                        page_words[page_num] = get_page_words(page_texts[page_num])
+                    window = fuzzy_find_window(tokens, page_words[page_num])
+                    if window is None or window[1] - window[0] > FUZZY_MAX_WINDOW:
+                        continue
+                    search_text = page_texts[page_num][window[0]:window[1]]
+                    page, textpage = textpages[page_num]
+                    text_instances = page.search_for(search_text, quads=True, textpage=textpage)
                     if text_instances:
-                        color = get_highlight_color(importance)
-                        
-                        for quad in text_instances:
-                            highlight = page.add_highlight_annot(quad)
-                            if highlight:
-                                highlight.set_colors(stroke=color)
-                                highlight.set_opacity(0.5)
-                                summary = annotation.get('summary', '')
-                                category = annotation.get('category', '')
-                                tooltip = f"[{category.upper()}] {summary}" if category else summary
-                                if tooltip:
-                                    highlight.set_info(content=tooltip)
-                                highlight.update()
-                                highlights_added += 1
-                                found = True
-                                found_page = page_num + 1  # 1-indexed for PDF viewers
-                                print(f"  ✓ Found: '{search_text[:40]}...' on page {found_page}")
-                        
-                        break  # Found on this page, move to next annotation
-            
+                        best = (search_text, page_num, text_instances)
+                        break
+
+            if best is not None:
+                search_text, page_num, text_instances = best
+                color = get_highlight_color(importance)
+                summary = annotation.get('summary', '')
+                category = annotation.get('category', '')
+                tooltip = f"[{category.upper()}] {summary}" if category else summary
+
+                batches.setdefault((page_num, color, tooltip), []).extend(text_instances)
+                highlights_added += len(text_instances)
+                found = True
+                found_page = page_num + 1  # 1-indexed for PDF viewers
+                logger.debug("  ✓ Found: '%s...' on page %d", search_text[:40], found_page)
+
+                last_found_page = page_num
+                match_cache[match_key] = best
+
             if not found:
-                print(f"  ✗ Not found: '{text_to_find[:50]}...'")
+                logger.debug("  ✗ Not found: '%s...'", text_to_find[:50])
             
             anno_with_page['page_number'] = found_page
             anno_with_page['found'] = found
             annotations_with_pages.append(anno_with_page)
         
-        # Save the modified PDF
-        if output_path is None:
-            output_path = pdf_path.replace('.pdf', '_highlighted.pdf')
-        
-        doc.save(output_path)
-        doc.close()
+        # Create the highlights: one annotation per page/color/tooltip group
+        for (page_num, color, tooltip), quads in batches.items():
+            highlight = textpages[page_num][0].add_highlight_annot(quads)
+            if highlight:
+                highlight.set_colors(stroke=color)
+                highlight.set_opacity(0.5)
+                if tooltip:
+                    highlight.set_info(content=tooltip)
+                highlight.update()
+
+        # Save the modified PDF (only the new annotation objects are written)
+        if doc.can_save_incrementally():
+            doc.save(output_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+            doc.close()
+        else:
+            # e.g. a damaged file MuPDF had to repair - needs a full rewrite
+            temp_path = output_path + '.tmp'
+            doc.save(temp_path)
+            doc.close()
+            os.replace(temp_path, output_path)
         
         print(f"✅ Added {highlights_added} highlights to PDF (skipped {skipped}): {output_path}")
         
@@ -123,9 +473,7 @@ def add_highlights_to_pdf(pdf_path: str, annotations: list, output_path: str = N
         }
         
     except Exception as e:
-        print(f"❌ Failed to add highlights to PDF: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Failed to add highlights to PDF: %s", e)
         return {
             "success": False,
             "error": str(e),
@@ -137,7 +485,9 @@ def add_highlights_to_pdf(pdf_path: str, annotations: list, output_path: str = N
 def create_highlighted_pdf_preview(
     template_name: str, 
     placeholders: dict, 
-    annotations: list
+    annotations: list,
+    cache_key: str = None,
+    use_cache: bool = True
 ) -> dict:
     """
     Generate a PDF preview with AI-based highlights.
@@ -145,11 +495,21 @@ def create_highlighted_pdf_preview(
     1. Generate PDF from template
     2. Add highlight annotations
     3. Return path to highlighted PDF
+    Identical (template, placeholders, annotations) requests are served from
+    the highlight cache; cached results carry "cached": True and their
+    pdf_path must not be deleted by the caller. Callers that derived the
+    annotations themselves (AI) pass the cache_key of their own inputs.
     """
     try:
         # Import contract service for PDF generation
         import contract_service
-        
+
+        if cache_key is None:
+            cache_key = highlight_cache_key(template_name, placeholders, annotations)
+        cached = get_cached_highlight(cache_key) if use_cache else None
+        if cached:
+            return {"success": True, "cached": True, **cached}
+
         print(f"📄 Creating highlighted PDF for template: {template_name}")
         
         # Generate the base PDF
@@ -162,12 +522,15 @@ def create_highlighted_pdf_preview(
             }
         
         prepare_id = prepare_result.get('prepare_id')
-        pdf_path = contract_service.get_prepared_contract(prepare_id)
+        pdf_path = contract_service.get_prepared_contract(
+            prepare_id, wait_seconds=contract_service.PREPARED_PDF_MAX_WAIT_SECONDS)
         
         if not pdf_path:
+            pending = contract_service.is_prepared_contract_pending(prepare_id)
+            contract_service.cleanup_prepared_contract(prepare_id)
             return {
                 "success": False,
-                "error": "PDF file not found"
+                "error": "PDF is still being generated, please retry" if pending else "PDF file not found"
             }
         
         # Add highlights
@@ -175,13 +538,29 @@ def create_highlighted_pdf_preview(
         result = add_highlights_to_pdf(pdf_path, annotations, highlighted_path)
         
         if result.get('success'):
+            meta = {
+                "highlights_added": result.get('highlights_added', 0),
+                "annotations_with_pages": result.get('annotations_with_pages', [])
+            }
+            try:
+                if use_cache:
+                    cached_path = set_cached_highlight(cache_key, highlighted_path, meta)
+                    return {
+                        "success": True,
+                        "cached": True,
+                        "pdf_path": cached_path,
+                        "original_path": pdf_path,
+                        "prepare_id": prepare_id,
+                        **meta
+                    }
+            except OSError as e:
+                print(f"⚠️ Could not cache highlighted PDF: {e}")
             return {
                 "success": True,
                 "pdf_path": highlighted_path,
                 "original_path": pdf_path,
                 "prepare_id": prepare_id,
-                "highlights_added": result.get('highlights_added', 0),
-                "annotations_with_pages": result.get('annotations_with_pages', [])
+                **meta
             }
         else:
             # Return original PDF if highlighting failed
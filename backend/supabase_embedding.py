@@ -7,6 +7,9 @@ Usage: python supabase_embedding.py <ic_image> <face_image>
 
 import os
 import sys
+import base64
+import functools
+import json
 import cv2
 import numpy as np
 
@@ -22,39 +25,147 @@ MODEL_NAME = "Facenet512"
 PASSING_THRESHOLD_DISTANCE = 30.0  # Same as app.py
 SUPABASE_URL = "https://umldjcyvmtjtjyyhspif.supabase.co"
 SUPABASE_KEY = "sb_publishable_-pTAB3wbjcbHlVCmzYjKlg_KHN4VyqW"
+# Store embeddings as int8 + float32 norm (516 B instead of 2 KB). Same env flag as config.py
+EMBEDDING_INT8 = os.getenv("EMBEDDING_INT8", "false").lower() == "true"
 
+# One keep-alive session for every Supabase call (no TLS handshake per request)
+_session = requests.Session()
+_session.headers.update({
+    "apikey": SUPABASE_KEY,
+    "Authorization": f"Bearer {SUPABASE_KEY}",
+    "Content-Type": "application/json",
+    "Prefer": "return=representation"
+})
 
-def generate_embedding(image_path: str) -> list:
-    """Generate face embedding from image file."""
+# DeepFace.represent with this tool's fixed options bound once
+_represent = functools.partial(
+    DeepFace.represent,
+    model_name=MODEL_NAME,
+    enforce_detection=False,
+    detector_backend='opencv'
+)
+
+
+def generate_embedding(image_path: str, skip_detection: bool = False) -> np.ndarray:
+    """
+    Generate face embedding (float32 ndarray) from image file.
+    skip_detection: the image is already a face crop - skip the detector
+    and embed the whole image.
+    """
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"Could not read image: {image_path}")
     
-    h, w = img.shape[:2]
-    if max(h, w) > 800:
-        scale = 800 / max(h, w)
-        img = cv2.resize(img, (int(w * scale), int(h * scale)))
-        temp_path = "temp_resized.jpg"
-        cv2.imwrite(temp_path, img)
-        image_path = temp_path
+    max_dim = max(img.shape[:2])
+    if max_dim > 800:
+        scale = 800 / max_dim
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
     
-    result = DeepFace.represent(
-        img_path=image_path,
-        model_name=MODEL_NAME,
-        enforce_detection=False,
-        detector_backend='opencv'
-    )
+    # DeepFace accepts the BGR array directly - no temp JPEG
+    if skip_detection:
+        # DeepFace's 'skip' backend only resizes/normalizes to the model input
+        result = _represent(img_path=img, detector_backend='skip')
+    else:
+        result = _represent(img_path=img)
     
-    embedding = result[0]["embedding"]
+    # Convert once here; distance math then works on contiguous float32
+    embedding = np.asarray(result[0]["embedding"], dtype=np.float32)
     return embedding
 
 
-def calculate_distance(embedding1: list, embedding2: list) -> float:
+def calculate_distance(embedding1: np.ndarray, embedding2: np.ndarray) -> float:
     """Calculate Euclidean distance between two embeddings."""
-    vec1 = np.array(embedding1)
-    vec2 = np.array(embedding2)
-    distance = np.linalg.norm(vec1 - vec2)
-    return distance
+    diff = np.asarray(embedding1, dtype=np.float32) - np.asarray(embedding2, dtype=np.float32)
+    return float(np.sqrt(np.dot(diff, diff)))
+
+
+# Prefix of this tool's int8 rows ("i8n:" + base64 of float32 norm + int8 bytes)
+INT8_NORM_PREFIX = 'i8n:'
+
+
+def quantize_embedding(embedding: np.ndarray) -> tuple:
+    """
+    Quantize to (int8 unit direction, float32 norm). The direction uses the
+    fixed scale 127 like face_service; the norm keeps Euclidean distances intact.
+    """
+    arr = np.asarray(embedding, dtype=np.float32)
+    norm = np.float32(np.linalg.norm(arr))
+    unit = arr / norm if norm > 0 else arr
+    return np.clip(np.round(unit * 127), -127, 127).astype(np.int8), norm
+
+
+def dequantize_embedding(q: np.ndarray, norm) -> np.ndarray:
+    """Rebuild a float32 embedding from its int8 direction and norm."""
+    return q.astype(np.float32) * (np.float32(norm) / 127)
+
+
+def encode_embedding(embedding: np.ndarray) -> str:
+    """
+    Pack embedding for Supabase as base64 float32 bytes (half the size of a
+    JSON float list), or INT8_NORM_PREFIX + norm + int8 bytes when EMBEDDING_INT8 is on.
+    """
+    if EMBEDDING_INT8:
+        q, norm = quantize_embedding(embedding)
+        return INT8_NORM_PREFIX + base64.b64encode(norm.tobytes() + q.tobytes()).decode('ascii')
+    return base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode('ascii')
+
+
+def decode_embedding(stored) -> np.ndarray:
+    """
+    Unpack a stored embedding (base64 float32, int8, or a legacy JSON float list).
+    """
+    if isinstance(stored, str):
+        if stored.lstrip().startswith('['):
+            # Legacy rows migrated to TEXT: JSON list of floats
+            return np.asarray(json.loads(stored), dtype=np.float32)
+        if stored.startswith(INT8_NORM_PREFIX):
+            raw = base64.b64decode(stored[len(INT8_NORM_PREFIX):])
+            norm = np.frombuffer(raw[:4], dtype=np.float32)[0]
+            return dequantize_embedding(np.frombuffer(raw[4:], dtype=np.int8), norm)
+        return np.frombuffer(base64.b64decode(stored), dtype=np.float32)
+    return np.asarray(stored, dtype=np.float32)
+
+
+def fetch_gallery(dim: int) -> np.ndarray:
+    """
+    Fetch every registered IC embedding as one contiguous (N, dim) float32
+    matrix. Rows of another length (e.g. from a different model) are skipped.
+    """
+    url = f"{SUPABASE_URL}/rest/v1/register_image?select=register_ic_embedding"
+    response = _session.get(url)
+    response.raise_for_status()
+
+    rows = [decode_embedding(row["register_ic_embedding"])
+            for row in response.json() if row.get("register_ic_embedding")]
+    rows = [row for row in rows if len(row) == dim]
+    if not rows:
+        return np.empty((0, dim), dtype=np.float32)
+    return np.ascontiguousarray(np.stack(rows))
+
+
+def find_closest_match(query: np.ndarray, gallery: np.ndarray) -> tuple:
+    """
+    Find the gallery row closest to the query embedding.
+    Ranks with ||g||^2 - 2 g.q (one BLAS matrix-vector product, no (N, D)
+    difference matrix), then computes the exact distance of the winner.
+    Returns (index, distance), or (-1, inf) for an empty gallery.
+    """
+    if gallery.size == 0:
+        return -1, float('inf')
+    query = np.asarray(query, dtype=np.float32)
+    sq_norms = np.einsum('ij,ij->i', gallery, gallery)
+    best = int(np.argmin(sq_norms - 2 * (gallery @ query)))
+    return best, calculate_distance(gallery[best], query)
+
+
+def store_embeddings(embeddings: list):
+    """
+    Insert IC embeddings into register_image in one round trip
+    (PostgREST accepts a JSON array for bulk inserts).
+    """
+    url = f"{SUPABASE_URL}/rest/v1/register_image"
+    data = [{"register_ic_embedding": encode_embedding(e)} for e in embeddings]
+    return _session.post(url, json=data)
 
 
 def main():
@@ -97,7 +208,7 @@ def main():
     # Generate Face embedding
     print()
     print("  🔄 [2/2] Processing Face image...")
-    face_embedding = generate_embedding(face_image)
+    face_embedding = generate_embedding(face_image, skip_detection=True)  # Already cropped
     print(f"       ✅ Generated embedding (length: {len(face_embedding)})")
     
     # Calculate distance
@@ -124,19 +235,25 @@ def main():
         print("  ║  ✅ MATCH - Identity Verified!                         ║")
         print("  ╚════════════════════════════════════════════════════════╝")
         print()
+        print("  🔎 Searching registered embeddings...")
+
+        # Compare the IC against every registered one in a single pass
+        try:
+            gallery = fetch_gallery(len(ic_embedding))
+            best, best_distance = find_closest_match(ic_embedding, gallery)
+            if best == -1:
+                print("       ℹ️  No registered embeddings yet")
+            else:
+                print(f"       Closest of {len(gallery)}: distance {best_distance:.4f}")
+                if best_distance < PASSING_THRESHOLD_DISTANCE:
+                    print("       ⚠️  This IC matches an existing registration")
+        except (requests.RequestException, ValueError) as e:
+            print(f"       ⚠️  Could not search registered embeddings: {e}")
+        print()
         print("  💾 Storing embedding to Supabase...")
         
         # Store IC embedding to Supabase
-        headers = {
-            "apikey": SUPABASE_KEY,
-            "Authorization": f"Bearer {SUPABASE_KEY}",
-            "Content-Type": "application/json",
-            "Prefer": "return=representation"
-        }
-        url = f"{SUPABASE_URL}/rest/v1/register_image"
-        data = {"register_ic_embedding": ic_embedding}
-        
-        response = requests.post(url, headers=headers, json=data)
+        response = store_embeddings([ic_embedding])
         
         if response.status_code in [200, 201]:
             print("       ✅ Embedding stored in Supabase!")
@@ -150,10 +267,6 @@ def main():
         print("  ⏸️  Embedding kept in memory only (not stored)")
     
     print()
-    
-    # Cleanup
-    if os.path.exists("temp_resized.jpg"):
-        os.remove("temp_resized.jpg")
 
 
 if __name__ == "__main__":
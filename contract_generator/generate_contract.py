@@ -1,4 +1,10 @@
 import os
+import re
+import copy
+import json
+import hashlib
+import functools
+from pathlib import Path
 from docxtpl import DocxTemplate
 from datetime import datetime
 
@@ -7,8 +13,10 @@ TEMPLATE_FILE = "freelance_contracts.docx"
 OUTPUT_DIR = "output"
 
 # Ensure output directory exists
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+Path(OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
+
+# Anything outside this set (spaces, slashes, Windows-reserved and control chars) becomes "_"
+_SANITIZE = re.compile(r'[^A-Za-z0-9._-]+')
 
 def get_user_input():
     print("--- Contract Generator ---")
@@ -54,10 +62,25 @@ def get_user_input():
         'signing_date': datetime.now().strftime("%d %B %Y")
     }
 
+@functools.lru_cache(maxsize=4)
+def _load_template(path, mtime):
+    """Parse the template once per file version (mtime is part of the cache key)"""
+    tpl = DocxTemplate(path)
+    if hasattr(tpl, 'init_docx'):
+        # Newer docxtpl defers the zip/XML parse until render; do it now
+        tpl.init_docx()
+    return tpl
+
+
+def load_template():
+    """Private copy of the parsed template - render() mutates the document"""
+    return copy.deepcopy(_load_template(TEMPLATE_FILE, os.path.getmtime(TEMPLATE_FILE)))
+
+
 def generate_document():
     try:
-        # Load the template
-        doc = DocxTemplate(TEMPLATE_FILE)
+        # Load the template (parsed once, edits to the file are picked up)
+        doc = load_template()
         
         # Get data from user (or hardcode it for testing)
         context = get_user_input()
@@ -65,11 +88,11 @@ def generate_document():
         # Render the tags
         doc.render(context)
         
-        # Create unique filename
-        filename = f"Contract_{context['company_name']}_{context['contractor_name']}.docx"
-        # Remove spaces/special chars from filename for safety
-        filename = filename.replace(" ", "_").replace("/", "-")
-        output_path = os.path.join(OUTPUT_DIR, filename)
+        # Create unique filename - the context hash keeps different contracts
+        # between the same two parties from overwriting each other
+        safe = _SANITIZE.sub('_', f"Contract_{context['company_name']}_{context['contractor_name']}")
+        suffix = hashlib.blake2b(json.dumps(context, sort_keys=True).encode(), digest_size=4).hexdigest()
+        output_path = os.path.join(OUTPUT_DIR, f"{safe}_{suffix}.docx")
         
         # Save
         doc.save(output_path)
@@ -10,6 +10,8 @@ import { analyzeContract, getImportanceColors, getCategoryInfo } from '../../ser
 
 // Backend API URL for contract preview
 const BACKEND_URL = import.meta.env.VITE_BACKEND_URL || 'http://localhost:5000'
+// Polls of /get_prepared_contract while the PDF is still being generated (202)
+const PREPARED_MAX_POLLS = 20
 
 export default function PDFPreviewModal({
   isOpen,
@@ -154,8 +156,14 @@ export default function PDFPreviewModal({
 
   const fetchPreparedContract = async (prepareId) => {
     try {
-      const response = await fetch(`${BACKEND_URL}/get_prepared_contract/${prepareId}`)
-      if (!response.ok) {
+      let response = await fetch(`${BACKEND_URL}/get_prepared_contract/${prepareId}`)
+      // 202 = PDF still being generated; poll after Retry-After
+      for (let attempt = 0; response.status === 202 && attempt < PREPARED_MAX_POLLS; attempt++) {
+        const retryAfter = Number(response.headers.get('Retry-After')) || 3
+        await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000))
+        response = await fetch(`${BACKEND_URL}/get_prepared_contract/${prepareId}`)
+      }
+      if (response.status === 202 || !response.ok) {
         throw new Error(`Failed to fetch prepared contract: ${response.status}`)
       }
       const pdfBlob = await response.blob()
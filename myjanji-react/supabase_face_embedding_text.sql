@@ -0,0 +1,17 @@
+-- Face embeddings as compact text
+-- Run this once in the Supabase SQL Editor before deploying the backend that
+-- returns face_embedding from /upload_ic as a base64 string (float32 bytes,
+-- or "i8:" + int8 bytes when EMBEDDING_INT8 is on).
+
+-- Existing FLOAT8[] vectors become JSON text ('[0.12, -0.03, ...]'),
+-- which the backend still decodes as legacy embeddings
+ALTER TABLE users
+  ALTER COLUMN face_embedding TYPE TEXT
+  USING array_to_json(face_embedding)::text;
+
+-- IC embeddings written by backend/supabase_embedding.py (base64 float32, or
+-- "i8n:" + float32 norm + int8 bytes when EMBEDDING_INT8 is on).
+-- If the column is JSONB instead, use: USING register_ic_embedding::text
+ALTER TABLE register_image
+  ALTER COLUMN register_ic_embedding TYPE TEXT
+  USING array_to_json(register_ic_embedding)::text;